@@ -0,0 +1,116 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_KEY = 'auth_token:{generation}:{digest}'
+# поколение ключей токенов в общем кэше: clear() меняет его,
+# не трогая остальные данные кэша
+GENERATION_KEY = 'auth_token_generation'
+
+
+def cache_key(key, generation):
+    # сам токен в ключ кэша не попадает
+    return TOKEN_KEY.format(
+        generation=generation,
+        digest=hashlib.sha256(key.encode()).hexdigest(),
+    )
+
+
+class TokenCache:
+    """Токен -> (пользователь, токен) на ttl секунд.
+
+    С backend (псевдоним из CACHES) записи хранятся в общем кэше:
+    сброс записи сразу виден всем воркерам gunicorn. Без него хранит
+    не больше max_size записей в памяти процесса и вытесняет давно
+    не использованные"""
+
+    def __init__(self, max_size, ttl, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[self.backend] if self.backend else None
+
+    def generation(self):
+        return self.shared.get_or_set(
+            GENERATION_KEY, time.time_ns, timeout=None
+        )
+
+    def get(self, key):
+        if self.shared is not None:
+            return self.shared.get(cache_key(key, self.generation()))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.shared is not None:
+            self.shared.set(
+                cache_key(key, self.generation()), value, timeout=self.ttl
+            )
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        if self.shared is not None:
+            generation = self.generation()
+            self.shared.delete_many(
+                [cache_key(key, generation) for key in keys]
+            )
+            return
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        if self.shared is not None:
+            self.shared.set(GENERATION_KEY, time.time_ns(), timeout=None)
+        with self.lock:
+            self.entries.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД для недавно виденных токенов.
+
+    Записи сбрасываются при удалении токена (выход через djoser)
+    и любом сохранении пользователя (смена пароля, деактивация).
+    Счётчики пользователя из кэша могут отставать, но save() их
+    не записывает (User.DERIVED_FIELDS)"""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            token_cache.set(key, cached)
+        user, token = cached
+        # каждый запрос получает свою копию: атрибуты, которые view
+        # вешает на request.user, не должны попасть в кэш
+        return copy.copy(user), token
+
+
+token_cache = TokenCache(
+    settings.TOKEN_CACHE_SIZE,
+    settings.TOKEN_CACHE_TTL,
+    settings.TOKEN_CACHE_BACKEND,
+)
@@ -0,0 +1,272 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from api.serializers import RecipeSnapshotSerializer
+from recipes.models import Favorite, IngredientToRecipe, Recipe, ShoppingCart
+from users.models import Subscribe
+
+VERSION_KEY = 'version:{name}'
+SNAPSHOT_KEY = 'recipe_snapshot:{version}:{pk}'
+USER_IDS_KEY = 'user_ids:{kind}:{user_id}:{version}'
+PAGE_KEY = 'recipe_page:{versions}:{digest}'
+CHANGES_KEY = 'changes:{name}'
+CHANGE_KEY = 'changes:{name}:{number}'
+
+# наборы id, из которых у представления рецепта заполняются флаги
+USER_ID_SETS = {
+    'favorites': lambda user: Favorite.objects.filter(
+        user=user
+    ).values_list('recipe_id', flat=True),
+    'cart': lambda user: ShoppingCart.objects.filter(
+        user=user
+    ).values_list('recipe_id', flat=True),
+    'subscriptions': lambda user: Subscribe.objects.filter(
+        user=user
+    ).values_list('author_id', flat=True),
+}
+# счётчики, по которым сортируется список рецептов: их изменения
+# не трогают представления рецептов, но меняют порядок страниц
+ORDERING_VERSIONS = {'favorites_count': 'recipe_favorites'}
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    """Текущая версия именованного набора данных в кэше.
+
+    Версия - время последнего изменения в миллисекундах, поэтому
+    после вытеснения ключа она не совпадёт ни с одной из прежних"""
+    key = VERSION_KEY.format(name=name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, now_ms(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(names):
+    """Версии нескольких наборов данных одним обращением к кэшу"""
+    keys = {name: VERSION_KEY.format(name=name) for name in names}
+    cached = cache.get_many(keys.values())
+    return {
+        name: cached[key] if key in cached else get_version(name)
+        for name, key in keys.items()
+    }
+
+
+def ordering_version_names(request):
+    """Версии счётчиков из параметра ordering запроса"""
+    fields = {
+        field.strip().lstrip('-')
+        for field in request.GET.get('ordering', '').split(',')
+    }
+    return [
+        name for field, name in ORDERING_VERSIONS.items() if field in fields
+    ]
+
+
+def bump_version(name):
+    """Делает устаревшими все ключи, построенные на версии name"""
+    version = max(get_version(name) + 1, now_ms())
+    cache.set(VERSION_KEY.format(name=name), version, timeout=None)
+    return version
+
+
+def changes_number(name):
+    """Номер последней записи журнала изменений name.
+
+    Нумерация начинается со времени в микросекундах: после вытеснения
+    ключа номера не продолжат прежние, и читатель увидит пропуск"""
+    key = CHANGES_KEY.format(name=name)
+    number = cache.get(key)
+    if number is None:
+        cache.add(key, now_ms() * 1000, timeout=None)
+        number = cache.get(key)
+    return number
+
+
+def record_changes(name, pks):
+    """Дописывает в журнал name id изменённых объектов"""
+    key = CHANGES_KEY.format(name=name)
+    changes_number(name)
+    # incr файлового кэша не атомарен: номер, уже занятый другим
+    # процессом, пропускается
+    for _ in range(3):
+        try:
+            number = cache.incr(key)
+        except ValueError:
+            # ключ вытеснен между чтением и incr
+            break
+        if cache.add(
+            CHANGE_KEY.format(name=name, number=number),
+            list(pks),
+            timeout=settings.CHANGES_TIMEOUT,
+        ):
+            return
+    # записать не удалось: читатели перечитают данные целиком
+    bump_version(name)
+
+
+def read_changes(name, numbers):
+    """Записи журнала name с номерами numbers: номер -> id.
+    Вытесненных и ещё не записанных номеров в ответе нет"""
+    keys = {
+        number: CHANGE_KEY.format(name=name, number=number)
+        for number in numbers
+    }
+    cached = cache.get_many(keys.values())
+    return {
+        number: cached[key] for number, key in keys.items() if key in cached
+    }
+
+
+def user_version_name(user_id):
+    """Версия данных, зависящих от пользователя:
+    избранное, список покупок и подписки"""
+    return f'user:{user_id}'
+
+
+def snapshot_key(pk, version):
+    return SNAPSHOT_KEY.format(version=version, pk=pk)
+
+
+def invalidate_recipes(pks):
+    version = get_version('recipes')
+    cache.delete_many([snapshot_key(pk, version) for pk in pks])
+    bump_version('recipe_list')
+
+
+def invalidate_all_recipes():
+    bump_version('recipes')
+
+
+def build_snapshots(pks):
+    """Представления рецептов без запроса в контексте: ссылки
+    на фото остаются относительными, схему и хост к ним добавляет
+    absolute_urls для каждого запроса"""
+    recipes = Recipe.objects.filter(pk__in=pks).select_related(
+        'author'
+    ).prefetch_related(
+        'tags',
+        Prefetch(
+            'ingredients',
+            queryset=IngredientToRecipe.objects.select_related('ingredient')
+        ),
+    )
+    return {
+        recipe.pk: RecipeSnapshotSerializer(recipe).data
+        for recipe in recipes
+    }
+
+
+def get_snapshots(pks):
+    """Представления рецептов без пользовательских полей:
+    из кэша, а недостающие - из БД с сохранением в кэш"""
+    version = get_version('recipes')
+    keys = {pk: snapshot_key(pk, version) for pk in pks}
+    cached = cache.get_many(keys.values())
+    snapshots = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+    missing = [pk for pk in pks if pk not in snapshots]
+    if missing:
+        built = build_snapshots(missing)
+        cache.set_many(
+            {keys[pk]: data for pk, data in built.items()},
+            timeout=settings.RECIPE_SNAPSHOT_TIMEOUT,
+        )
+        snapshots.update(built)
+    return snapshots
+
+
+def user_id_sets(user):
+    """id рецептов в избранном и в списке покупок и id авторов
+    в подписках. При промахе кэша - по запросу на набор; наборы
+    сбрасываются вместе с версией данных пользователя"""
+    if user.is_anonymous:
+        return {kind: frozenset() for kind in USER_ID_SETS}
+    version = get_version(user_version_name(user.pk))
+    keys = {
+        kind: USER_IDS_KEY.format(
+            kind=kind, user_id=user.pk, version=version
+        )
+        for kind in USER_ID_SETS
+    }
+    cached = cache.get_many(keys.values())
+    sets = {}
+    missing = {}
+    for kind, key in keys.items():
+        if key in cached:
+            sets[kind] = cached[key]
+        else:
+            sets[kind] = missing[key] = frozenset(USER_ID_SETS[kind](user))
+    if missing:
+        cache.set_many(missing, timeout=settings.RECIPE_SNAPSHOT_TIMEOUT)
+    return sets
+
+
+def absolute_urls(representation, request):
+    """Ссылки на фото в снимке со схемой и хостом текущего запроса"""
+    if representation['image']:
+        representation['image'] = request.build_absolute_uri(
+            representation['image']
+        )
+    for urls in (representation['image_variants'] or {}).values():
+        for extension, url in urls.items():
+            urls[extension] = request.build_absolute_uri(url)
+
+
+def recipe_representations(pks, request):
+    """Представления рецептов для текущего пользователя:
+    общая часть из кэша, флаги - из наборов id пользователя"""
+    snapshots = get_snapshots(pks)
+    sets = user_id_sets(request.user)
+
+    data = []
+    for pk in pks:
+        if pk not in snapshots:
+            continue
+        representation = snapshots[pk]
+        if representation['author'] is not None:
+            representation['author']['is_subscribed'] = (
+                representation['author']['id'] in sets['subscriptions']
+            )
+        absolute_urls(representation, request)
+        representation['is_favorited'] = pk in sets['favorites']
+        representation['is_in_shopping_cart'] = pk in sets['cart']
+        data.append(representation)
+    return data
+
+
+def recipe_page_key(request, per_user=False):
+    """Ключ страницы списка рецептов: одинаковый для всех, кто
+    запросил тот же адрес, если результат не зависит от пользователя"""
+    names = ['recipes', 'recipe_list', *ordering_version_names(request)]
+    if per_user and not request.user.is_anonymous:
+        names.append(user_version_name(request.user.pk))
+    versions = get_versions(names)
+    params = sorted(request.query_params.lists())
+    address = '|'.join((
+        request.build_absolute_uri(request.path),
+        urlencode(params, doseq=True),
+        str(request.user.pk) if per_user else '',
+    ))
+    return PAGE_KEY.format(
+        versions='.'.join(str(versions[name]) for name in sorted(versions)),
+        digest=hashlib.sha1(address.encode()).hexdigest(),
+    )
+
+
+def get_page(key, build):
+    """Страница с id рецептов в results: из кэша или build()"""
+    page = cache.get(key)
+    if page is None:
+        page = build()
+        cache.set(key, page, timeout=settings.RECIPE_PAGE_TIMEOUT)
+    return page
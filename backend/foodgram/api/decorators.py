@@ -0,0 +1,38 @@
+import hashlib
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from api.cache import (get_versions, ordering_version_names,
+                       user_version_name)
+
+
+def conditional(*names, per_user=False):
+    """Декоратор метода вьюсета: ETag по версиям наборов данных
+    в кэше. На If-None-Match отвечает 304, не вызывая метод
+    и сериалайзеры. Last-Modified не отдаётся: с точностью до секунды
+    он пропустил бы изменение в ту же секунду, а с per_user - и чужое
+    изменение, учтённое в ETag только для его владельца.
+
+    per_user=True добавляет версию данных текущего пользователя,
+    чтобы флаги is_favorited и т.п. не отдавались из чужого кэша.
+    Сортировка по счётчику (ordering) добавляет его версию"""
+
+    def request_versions(request):
+        version_names = [*names, *ordering_version_names(request)]
+        if per_user and not request.user.is_anonymous:
+            version_names.append(user_version_name(request.user.pk))
+        return get_versions(version_names)
+
+    def etag(request, *args, **kwargs):
+        versions = request_versions(request)
+        validator = '|'.join((
+            str(request.user.pk),
+            # ссылки на фото в ответе абсолютные
+            request.build_absolute_uri('/'),
+            request.META.get('HTTP_ACCEPT', ''),
+            *(f'{name}={versions[name]}' for name in sorted(versions)),
+        ))
+        return hashlib.sha1(validator.encode()).hexdigest()
+
+    return method_decorator(condition(etag_func=etag))
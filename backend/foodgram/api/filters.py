@@ -1,24 +1,72 @@
 import django_filters.rest_framework as filters
 from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe, Tag
+from api.ingredient_index import ingredient_index
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag
+from recipes.search import search_recipes
+from recipes.tag_masks import bits_mask, with_any_bit
+
+
+# фильтры, результат которых зависит от текущего пользователя
+USER_FILTERS = {
+    'is_favorited': Favorite,
+    'is_in_shopping_cart': ShoppingCart,
+}
 
 
 class RecipeFilter(filters.FilterSet):
-    is_favorited = filters.BooleanFilter(field_name='is_favorited')
-    is_in_shopping_cart = filters.BooleanFilter(
-        field_name='is_in_shopping_cart'
-    )
+    is_favorited = filters.BooleanFilter(method='filter_user_links')
+    is_in_shopping_cart = filters.BooleanFilter(method='filter_user_links')
     tags = filters.ModelMultipleChoiceFilter(
         queryset=Tag.objects.all(),
         field_name='tags__slug',
         to_field_name='slug',
+        method='filter_tags',
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart', 'tags', 'author',)
+        fields = (
+            'is_favorited', 'is_in_shopping_cart', 'tags', 'author', 'search',
+        )
+
+    def filter_user_links(self, queryset, name, value):
+        """Рецепты в избранном / списке покупок пользователя (или не
+        в нём). У анонима ни избранного, ни списка покупок нет"""
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none() if value else queryset
+        recipes = USER_FILTERS[name].objects.filter(user=user).values(
+            'recipe'
+        )
+        if value:
+            return queryset.filter(pk__in=recipes)
+        return queryset.exclude(pk__in=recipes)
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию,
+        сначала самые релевантные"""
+        return search_recipes(queryset, value)
+
+    def filter_tags(self, queryset, name, tags):
+        """Любой из тегов: условие на маску тегов рецепта
+        вместо join с TagRecipe и DISTINCT"""
+        if not tags:
+            return queryset
+        if any(tag.bit is None for tag in tags):
+            # тег, которому не хватило бита в маске
+            return queryset.filter(tags__in=tags).distinct()
+        return with_any_bit(queryset, bits_mask(tag.bit for tag in tags))
 
 
 class IngredientSearchFilter(SearchFilter):
+    """Поиск по названию через индекс в памяти: сначала совпадения
+    по началу названия, затем по подстроке"""
     search_param = 'name'
+
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param)
+        if not name or view.action != 'list':
+            return super().filter_queryset(request, queryset, view)
+        return ingredient_index.search(name)
@@ -0,0 +1,83 @@
+import bisect
+import threading
+from itertools import accumulate
+
+from django.conf import settings
+
+from api.cache import get_version
+from recipes.models import Ingredient
+
+
+def normalize(text):
+    """Приводит строку к виду для сравнения: без регистра, ё -> е"""
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса.
+
+    Названия хранятся отсортированными: совпадения по префиксу ищутся
+    бинарным поиском, по подстроке - str.find по склеенным названиям.
+    Индекс перестраивается, когда меняется версия 'ingredients' в кэше"""
+
+    def __init__(self):
+        self.version = None
+        self.data = None
+        self.lock = threading.Lock()
+
+    def build(self, version):
+        entries = sorted(
+            (normalize(name), name, unit, pk)
+            for pk, name, unit in Ingredient.objects.order_by().values_list(
+                'pk', 'name', 'measurement_unit'
+            )
+        )
+        keys = [entry[0] for entry in entries]
+        # начало каждого названия в haystack (+1 на разделитель)
+        starts = [0] + list(accumulate(len(key) + 1 for key in keys))[:-1]
+        self.data = (keys, entries, '\n'.join(keys), starts)
+        self.version = version
+
+    def ensure_fresh(self):
+        version = get_version('ingredients')
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.build(version)
+
+    def search(self, query, limit=None):
+        """Ингредиенты, начинающиеся с query, затем содержащие query"""
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        self.ensure_fresh()
+        keys, entries, haystack, starts = self.data
+
+        found = []
+        position = bisect.bisect_left(keys, query)
+        while (
+            len(found) < limit and
+            position < len(keys) and
+            keys[position].startswith(query)
+        ):
+            found.append(position)
+            position += 1
+
+        position = haystack.find(query) if query else -1
+        while len(found) < limit and position != -1:
+            index = bisect.bisect_right(starts, position) - 1
+            if not keys[index].startswith(query):
+                found.append(index)
+            if index + 1 == len(keys):
+                break
+            position = haystack.find(query, starts[index + 1])
+
+        return [
+            Ingredient(pk=entries[index][3],
+                       name=entries[index][1],
+                       measurement_unit=entries[index][2])
+            for index in found
+        ]
+
+
+ingredient_index = IngredientIndex()
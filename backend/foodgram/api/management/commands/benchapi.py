@@ -0,0 +1,461 @@
+import base64
+import json
+import math
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.management.testdb import test_database
+from api.middleware import QueryLog, watch_queries
+from recipes import pdf_generator
+from recipes.models import (Ingredient, IngredientToRecipe, Recipe,
+                            ShoppingListJob, Tag)
+from recipes.pdf_cache import shopping_list_digest
+from users.models import Subscribe, User
+
+# картинка из примера в документации API
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywa'
+    'AAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQI'
+    'mWNoAAAAggCByxOyYQAAAABJRU5ErkJggg=='
+)
+IMAGE_CONTENT = base64.b64decode(IMAGE.partition(',')[2])
+
+# (название, авторизация, шаги); шаг - (метод, url, тело, статусы).
+# Шаги сценария выполняются по порядку на каждом повторе, поэтому
+# добавление и удаление связей не меняют данные. Тело-функция
+# отправляется как multipart-форма
+SCENARIOS = (
+    ('Рецепты', False, (('get', '/api/recipes/?limit=10', None, (200,)),)),
+    ('Рецепты', True, (('get', '/api/recipes/?limit=10', None, (200,)),)),
+    ('Рецепты по курсору', True, (
+        ('get', '/api/recipes/?cursor=&limit=10', None, (200,)),
+    )),
+    ('Рецепты по тегам', True, (
+        ('get', '/api/recipes/?limit=10&tags={tag}', None, (200,)),
+    )),
+    ('Рецепты автора', True, (
+        ('get', '/api/recipes/?limit=10&author={author}', None, (200,)),
+    )),
+    ('Популярные рецепты', True, (
+        ('get', '/api/recipes/?limit=10&ordering=-favorites_count', None,
+         (200,)),
+    )),
+    ('Избранное', True, (
+        ('get', '/api/recipes/?limit=10&is_favorited=1', None, (200,)),
+    )),
+    ('Рецепты в списке покупок', True, (
+        ('get', '/api/recipes/?limit=10&is_in_shopping_cart=1', None,
+         (200,)),
+    )),
+    ('Рецепт', False, (('get', '/api/recipes/{recipe}/', None, (200,)),)),
+    ('Рецепт', True, (('get', '/api/recipes/{recipe}/', None, (200,)),)),
+    ('Создание, изменение и удаление рецепта', True, (
+        ('post', '/api/recipes/', 'new_recipe', (201,)),
+        ('patch', '/api/recipes/{created}/', 'new_recipe', (200,)),
+        ('delete', '/api/recipes/{created}/', None, (204,)),
+    )),
+    ('Добавление в избранное', True, (
+        ('post', '/api/recipes/{other_recipe}/favorite/', None, (201,)),
+        ('delete', '/api/recipes/{other_recipe}/favorite/', None, (204,)),
+    )),
+    ('Добавление в список покупок', True, (
+        ('post', '/api/recipes/{other_recipe}/shopping_cart/', None, (201,)),
+        ('delete', '/api/recipes/{other_recipe}/shopping_cart/', None,
+         (204,)),
+    )),
+    ('Массовое добавление в избранное', True, (
+        ('post', '/api/recipes/favorite/', 'other_ids', (200,)),
+        ('delete', '/api/recipes/favorite/', 'other_ids', (200,)),
+    )),
+    ('Массовое добавление в список покупок', True, (
+        ('post', '/api/recipes/shopping_cart/', 'other_ids', (200,)),
+        ('delete', '/api/recipes/shopping_cart/', 'other_ids', (200,)),
+    )),
+    ('Загрузка фото', True, (
+        ('post', '/api/recipes/images/', 'image', (201,)),
+    )),
+    ('PDF списка покупок', True, (
+        ('get', '/api/recipes/download_shopping_cart/', None, (200, 202)),
+    )),
+    ('Статус генерации списка покупок', True, (
+        ('get', '/api/recipes/download_shopping_cart/jobs/{job}/', None,
+         (200,)),
+    )),
+    ('PDF сгенерированного списка покупок', True, (
+        ('get', '/api/recipes/download_shopping_cart/jobs/{job}/file/', None,
+         (200,)),
+    )),
+    ('Ингредиенты', False, (('get', '/api/ingredients/', None, (200,)),)),
+    ('Поиск ингредиентов', False, (
+        ('get', '/api/ingredients/?name={ingredient_query}', None, (200,)),
+    )),
+    ('Ингредиент', False, (
+        ('get', '/api/ingredients/{ingredient}/', None, (200,)),
+    )),
+    ('Теги', False, (('get', '/api/tags/', None, (200,)),)),
+    ('Тег', False, (('get', '/api/tags/{tag_id}/', None, (200,)),)),
+    ('Пользователи', True, (('get', '/api/users/?limit=10', None, (200,)),)),
+    ('Пользователь', True, (('get', '/api/users/{author}/', None, (200,)),)),
+    ('Текущий пользователь', True, (
+        ('get', '/api/users/me/', None, (200,)),
+    )),
+    ('Подписки', True, (
+        ('get', '/api/users/subscriptions/?limit=10&recipes_limit=3', None,
+         (200,)),
+    )),
+    ('Подписки по курсору', True, (
+        ('get', '/api/users/subscriptions/?cursor=&recipes_limit=3', None,
+         (200,)),
+    )),
+    ('Подписка', True, (
+        ('post', '/api/users/{other_author}/subscribe/', None, (201,)),
+        ('delete', '/api/users/{other_author}/subscribe/', None, (204,)),
+    )),
+    ('Массовая подписка', True, (
+        ('post', '/api/users/subscribe/', 'other_author_ids', (200,)),
+        ('delete', '/api/users/subscribe/', 'other_author_ids', (200,)),
+    )),
+)
+
+# метрики, рост которых считается регрессией; хвосты p95/p99
+# на десятках повторов слишком шумные для автоматической проверки
+COMPARED = ('p50_ms', 'queries', 'peak_memory_kb')
+# рост меньше этих значений считается шумом
+NOISE = {'p50_ms': 2, 'peak_memory_kb': 64}
+MEMORY_PASSES = 3
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+@contextmanager
+def test_environment():
+    setup_test_environment()
+    try:
+        yield
+    finally:
+        teardown_test_environment()
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку (p50/p95/p99), число и время SQL-запросов '
+        'и пиковую память эндпоинтов API на синтетических данных '
+        'и сравнивает результат с сохранённым эталоном'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Замерять на текущей БД вместо временной с '
+                 'сгенерированными данными',
+        )
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом',
+        )
+        parser.add_argument(
+            '--allow-writes', action='store_true',
+            help='С --current-db выполнять сценарии, меняющие данные, '
+                 'и очистку кэша (--cold)',
+        )
+        parser.add_argument('--output', help='Куда записать результат (JSON)')
+        parser.add_argument('--baseline', help='Эталон для сравнения (JSON)')
+        parser.add_argument(
+            '--tolerance', type=float, default=20,
+            help='Допустимый рост метрик относительно эталона, %%',
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть больше 0')
+        if (
+            options['current_db'] and options['cold'] and
+            not options['allow_writes']
+        ):
+            raise CommandError(
+                '--cold очищает общий кэш: на текущей БД он работает '
+                'только вместе с --allow-writes'
+            )
+        if options['current_db']:
+            database = test_environment()
+        else:
+            database = test_database()
+        with database, tempfile.TemporaryDirectory() as media:
+            with override_settings(MEDIA_ROOT=media):
+                if not options['current_db']:
+                    call_command(
+                        'generatedata',
+                        users=options['users'],
+                        recipes=options['recipes'],
+                        seed=options['seed'],
+                        stdout=self.stdout,
+                    )
+                report = self.run_benchmark(options)
+
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='UTF-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            with open(options['baseline'], encoding='UTF-8') as file:
+                baseline = json.load(file)
+            regressions = self.compare(
+                report, baseline, options['tolerance']
+            )
+            if regressions:
+                raise CommandError(
+                    f'Регрессий относительно эталона: {regressions}'
+                )
+
+    def prepare_context(self):
+        """Данные для подстановки в url: самый активный пользователь,
+        его рецепты, рецепты, которых у него нет в избранном,
+        и готовая задача генерации его списка покупок"""
+        reader_id = Subscribe.objects.values('user').annotate(
+            total=Count('pk')
+        ).order_by('-total').values_list('user', flat=True).first()
+        if reader_id is None:
+            raise CommandError('В БД нет подписок, сгенерируйте данные')
+        reader = User.objects.get(pk=reader_id)
+        author = Subscribe.objects.filter(user=reader).values_list(
+            'author', flat=True
+        ).first()
+        other_authors = list(
+            User.objects.exclude(pk=reader.pk).exclude(
+                subscribed__user=reader
+            ).order_by('pk').values_list('pk', flat=True)[:10]
+        )
+        other_recipes = list(
+            Recipe.objects.exclude(favorite__user=reader).exclude(
+                shoppingcart__user=reader
+            ).order_by('-pk').values_list('pk', flat=True)[:10]
+        )
+        tag = Tag.objects.order_by('pk').first()
+        ingredients = list(Ingredient.objects.order_by('pk')[:2])
+        token, created = Token.objects.get_or_create(user=reader)
+        self.created_token = token if created else None
+        shopping_list = pdf_generator.parse_data(
+            IngredientToRecipe.objects.filter(
+                recipe__shoppingcart__user=reader
+            )
+        )
+        self.created_job = ShoppingListJob.objects.create(
+            user=reader,
+            digest=shopping_list_digest(shopping_list),
+            content=shopping_list,
+            status=ShoppingListJob.DONE,
+        )
+        context = {
+            'author': author,
+            'other_author': other_authors[0],
+            'recipe': Recipe.objects.filter(
+                author=author
+            ).values_list('pk', flat=True).first(),
+            'other_recipe': other_recipes[0],
+            'tag': tag.slug,
+            'tag_id': tag.pk,
+            'ingredient': ingredients[0].pk,
+            'ingredient_query': ingredients[0].name[:3],
+            'job': self.created_job.pk,
+        }
+        bodies = {
+            'other_ids': {'ids': other_recipes},
+            'other_author_ids': {'ids': other_authors},
+            # файл читается при отправке, поэтому на каждый запрос новый
+            'image': lambda: {
+                'image': SimpleUploadedFile(
+                    'bench.png', IMAGE_CONTENT, content_type='image/png'
+                ),
+            },
+            'new_recipe': {
+                'name': 'Рецепт для бенчмарка',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': IMAGE,
+                'tags': [tag.pk],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': 10}
+                    for ingredient in ingredients
+                ],
+            },
+        }
+        clients = {
+            False: Client(),
+            True: Client(HTTP_AUTHORIZATION=f'Token {token.key}'),
+        }
+        return context, bodies, clients
+
+    @staticmethod
+    def perform(client, step, context, bodies):
+        method, url, body, statuses = step
+        url = url.format(**context)
+        if body is None:
+            response = getattr(client, method)(url)
+        elif callable(bodies[body]):
+            response = getattr(client, method)(url, bodies[body]())
+        else:
+            response = getattr(client, method)(
+                url, json.dumps(bodies[body]), content_type='application/json'
+            )
+        if response.status_code not in statuses:
+            raise CommandError(
+                f'{method.upper()} {url}: статус {response.status_code}'
+            )
+        if method == 'post' and url == '/api/recipes/':
+            context['created'] = response.json()['id']
+
+    def run_steps(self, steps, client, context, bodies, cold, samples):
+        """Выполняет шаги сценария и копит замеры в samples"""
+        for step, step_samples in zip(steps, samples):
+            if cold:
+                cache.clear()
+                token_cache.clear()
+            queries = QueryLog(shapes=False)
+            started = time.perf_counter()
+            with watch_queries(queries):
+                self.perform(client, step, context, bodies)
+            elapsed = time.perf_counter() - started
+            step_samples.append((elapsed, queries.count, queries.duration))
+
+    def measure_memory(self, steps, client, context, bodies):
+        """Пиковая память Python на шагах сценария: отдельные проходы,
+        потому что tracemalloc сильно замедляет запросы; берётся
+        минимум, чтобы не учитывать разовые выделения"""
+        peaks = [[] for _ in steps]
+        for _ in range(MEMORY_PASSES):
+            for step, step_peaks in zip(steps, peaks):
+                tracemalloc.start()
+                self.perform(client, step, context, bodies)
+                step_peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        return [min(step_peaks) for step_peaks in peaks]
+
+    def run_benchmark(self, options):
+        context, bodies, clients = self.prepare_context()
+        try:
+            results = self.run_scenarios(options, context, bodies, clients)
+        finally:
+            # токен и задача, созданные для замера, не остаются в БД
+            if self.created_token is not None:
+                self.created_token.delete()
+            self.created_job.delete()
+        return {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'recipes': Recipe.objects.count(),
+                'users': User.objects.count(),
+                'repeat': options['repeat'],
+                'cold_cache': options['cold'],
+                'max_rss_kb': resource.getrusage(
+                    resource.RUSAGE_SELF
+                ).ru_maxrss,
+            },
+            'results': results,
+        }
+
+    def run_scenarios(self, options, context, bodies, clients):
+        results = {}
+        for name, auth, steps in SCENARIOS:
+            if (
+                options['current_db'] and not options['allow_writes'] and
+                any(method != 'get' for method, *_ in steps)
+            ):
+                self.stderr.write(
+                    f'{name}: пропущен, меняет данные (--allow-writes)'
+                )
+                continue
+            client = clients[auth]
+            samples = [[] for _ in steps]
+            # прогрев: первый запрос заполняет кэши и импорты
+            self.run_steps(
+                steps, client, context, bodies, options['cold'],
+                [[] for _ in steps],
+            )
+            for _ in range(options['repeat']):
+                self.run_steps(
+                    steps, client, context, bodies, options['cold'], samples
+                )
+            peaks = self.measure_memory(steps, client, context, bodies)
+            for (method, url, _, _), step_samples, peak in zip(
+                steps, samples, peaks
+            ):
+                latencies = [sample[0] * 1000 for sample in step_samples]
+                user = 'авторизован' if auth else 'аноним'
+                key = f'{name} ({user}) {method.upper()} {url}'
+                results[key] = {
+                    'p50_ms': round(percentile(latencies, 50), 2),
+                    'p95_ms': round(percentile(latencies, 95), 2),
+                    'p99_ms': round(percentile(latencies, 99), 2),
+                    'queries': max(sample[1] for sample in step_samples),
+                    'sql_ms': round(percentile(
+                        [sample[2] * 1000 for sample in step_samples], 50
+                    ), 2),
+                    'peak_memory_kb': round(peak / 1024),
+                }
+        return results
+
+    def print_report(self, report):
+        self.stdout.write(
+            f'{"p50":>8} {"p95":>8} {"p99":>8} {"SQL":>4} {"SQL мс":>7} '
+            f'{"КБ":>6}  эндпоинт'
+        )
+        for key, result in report['results'].items():
+            self.stdout.write(
+                f'{result["p50_ms"]:8.2f} {result["p95_ms"]:8.2f} '
+                f'{result["p99_ms"]:8.2f} {result["queries"]:4d} '
+                f'{result["sql_ms"]:7.2f} {result["peak_memory_kb"]:6d}  '
+                f'{key}'
+            )
+
+    def compare(self, report, baseline, tolerance):
+        """Печатает метрики, выросшие больше чем на tolerance процентов;
+        число SQL-запросов не должно расти вовсе"""
+        regressions = 0
+        for key, result in report['results'].items():
+            old = baseline['results'].get(key)
+            if old is None:
+                continue
+            for metric in COMPARED:
+                if metric == 'queries':
+                    limit = old[metric]
+                else:
+                    limit = max(
+                        old[metric] * (1 + tolerance / 100),
+                        old[metric] + NOISE[metric],
+                    )
+                if result[metric] > limit:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(
+                        f'{key}: {metric} {old[metric]} -> {result[metric]}'
+                    ))
+        return regressions
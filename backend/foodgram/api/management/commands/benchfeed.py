@@ -0,0 +1,191 @@
+import statistics
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.management.testdb import test_database
+from api.pagination import KeysetPagination
+from recipes.feed import fan_out, feed_querysets, fill_feeds
+from recipes.models import FeedEntry, Recipe
+from users.models import Subscribe, User
+
+PAGE_SIZE = 10
+PAGES = 5
+# подписки временного пользователя на случайных авторов
+FOLLOWED = 300
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает ленту подписок через join рецептов с подписками '
+        'и через разложенные записи лент: страницы по курсору, '
+        'публикация рецепта и подписка'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Замерять на текущей БД, а не на временной',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='Число рецептов во временной БД',
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=100,
+            help='Среднее число подписок пользователя во временной БД',
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+
+    @staticmethod
+    def walk(ordering, querysets, key):
+        """PAGES страниц по курсору: время каждой в мс и id рецептов"""
+        factory = APIRequestFactory()
+        paginator = KeysetPagination(ordering)
+        url = f'/api/recipes/feed/?limit={PAGE_SIZE}'
+        timings, ids = [], []
+        for _ in range(PAGES):
+            request = Request(factory.get(url))
+            started = time.perf_counter()
+            page = paginator.paginate_querysets(querysets(), request)
+            timings.append((time.perf_counter() - started) * 1000)
+            ids.extend(getattr(item, key) for item in page)
+            url = paginator.get_next_link()
+            if url is None:
+                break
+        return timings, ids
+
+    def measure(self, user, repeat):
+        def join():
+            return [
+                Recipe.objects.filter(
+                    author__subscribed__user=user
+                ).only('id', 'pub_date')
+            ]
+
+        def feed():
+            return feed_querysets(FeedEntry, Recipe, User, user)
+
+        results = {}
+        for name, ordering, querysets, key in (
+            ('join', ('-pub_date', '-id'), join, 'pk'),
+            ('feed', ('-pub_date', '-recipe_id'), feed, 'recipe_id'),
+        ):
+            runs = [
+                self.walk(ordering, querysets, key) for _ in range(repeat)
+            ]
+            first, last = zip(*(
+                (timings[0], timings[-1]) for timings, _ in runs
+            ))
+            results[name] = (
+                statistics.median(first), statistics.median(last), runs[0][1]
+            )
+        return results
+
+    def cases(self):
+        subscribers = Subscribe.objects.values('user').annotate(
+            total=Count('pk')
+        ).order_by('-total').values_list('user', 'total')
+        count = subscribers.count()
+        for label, index in (('больше всех подписок', 0), ('медиана', None)):
+            index = count // 2 if index is None else index
+            user, total = subscribers[index]
+            yield f'{label}: {total} подписок', user
+
+    def report(self, label, user, repeat):
+        results = self.measure(user, repeat)
+        join_first, join_last, expected = results['join']
+        feed_first, feed_last, found = results['feed']
+        if expected != found:
+            raise CommandError(f'{label}: результаты различаются')
+        self.stdout.write(
+            f'{join_first:>9.1f}{join_last:>9.1f}'
+            f'{feed_first:>9.1f}{feed_last:>9.1f}  {label}'
+        )
+
+    def measure_follower(self, repeat):
+        """Временный пользователь с FOLLOWED подписками на случайных
+        авторов без ленты при чтении; откатывается после замера"""
+        with transaction.atomic():
+            user = User.objects.create(
+                username='benchfeed', email='benchfeed@foodgram.test'
+            )
+            authors = User.objects.filter(
+                fanout_on_read=False, recipes_count__gt=0
+            ).exclude(pk=user.pk).order_by('?')[:FOLLOWED]
+            for author in authors:
+                Subscribe.objects.create(user=user, author=author)
+            self.report(
+                f'случайные авторы: {len(authors)} подписок', user.pk, repeat
+            )
+            transaction.set_rollback(True)
+
+    def measure_writes(self):
+        """Раскладка рецепта подписчикам самого популярного автора
+        без ленты при чтении и заполнение ленты при подписке на него"""
+        author = User.objects.filter(
+            fanout_on_read=False, recipes_count__gt=0
+        ).order_by('-subscribers_count').first()
+        if author is None:
+            return
+        recipe = author.recipes.order_by('-pub_date').first()
+        subscription = Subscribe.objects.filter(author=author).first()
+        for label, clear, write in (
+            (
+                f'Публикация рецепта ({author.subscribers_count} '
+                'подписчиков)',
+                FeedEntry.objects.filter(recipe=recipe),
+                lambda: fan_out(FeedEntry, Subscribe, recipe),
+            ),
+            (
+                f'Подписка ({author.recipes_count} рецептов автора)',
+                FeedEntry.objects.filter(
+                    user=subscription.user_id, author=author
+                ),
+                lambda: fill_feeds(
+                    FeedEntry, Subscribe.objects.filter(pk=subscription.pk)
+                ),
+            ),
+        ):
+            with transaction.atomic():
+                clear.delete()
+                started = time.perf_counter()
+                write()
+                elapsed = (time.perf_counter() - started) * 1000
+                transaction.set_rollback(True)
+            self.stdout.write(f'{label}: {elapsed:.1f} мс')
+
+    def handle(self, *args, **options):
+        if PAGES * PAGE_SIZE > settings.FEED_BACKFILL:
+            raise CommandError('Сравниваемые страницы длиннее FEED_BACKFILL')
+        context = nullcontext() if options['current_db'] else test_database()
+        with context:
+            if not options['current_db']:
+                call_command(
+                    'generatedata', users=options['recipes'] // 10,
+                    recipes=options['recipes'], favorites=0, cart=0,
+                    subscriptions=options['subscriptions'], seed=1,
+                    stdout=self.stdout,
+                )
+            if not Subscribe.objects.exists():
+                raise CommandError('В БД нет подписок')
+            self.stdout.write(
+                f'Рецептов: {Recipe.objects.count()}, '
+                f'записей в лентах: {FeedEntry.objects.count()}, авторов '
+                'с лентой при чтении: '
+                f'{User.objects.filter(fanout_on_read=True).count()}\n'
+                f'{"join, мс":>18}{"лента, мс":>18}\n'
+                f'{"1-я":>9}{f"{PAGES}-я":>9}{"1-я":>9}{f"{PAGES}-я":>9}'
+                '  пользователь'
+            )
+            for label, user in self.cases():
+                self.report(label, user, options['repeat'])
+            self.measure_follower(options['repeat'])
+            self.measure_writes()
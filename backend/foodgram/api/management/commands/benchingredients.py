@@ -0,0 +1,91 @@
+import csv
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Lower
+
+from api.ingredient_index import IngredientIndex
+from api.management.testdb import test_database
+from recipes.models import Ingredient
+
+ING_PATH = str(settings.BASE_DIR) + '/data/ingredients.csv'
+QUERIES = ('а', 'кар', 'картоф', 'мол', 'сыр твер', 'ябл', 'еж', 'соус')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск ингредиентов через БД (istartswith) '
+            'и через индекс в памяти на увеличенном каталоге')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=int, default=100,
+            help='Во сколько раз размножить data/ingredients.csv',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз повторить каждый запрос',
+        )
+
+    def fill_catalog(self, scale):
+        with open(ING_PATH, newline='', encoding='UTF-8') as ingredients:
+            rows = list(csv.reader(ingredients))
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(
+                    name=f'{name} {copy}' if copy else name,
+                    measurement_unit=unit,
+                )
+                for copy in range(scale)
+                for name, unit in rows
+            ),
+            batch_size=5000,
+        )
+        return len(rows) * scale
+
+    def measure(self, search, repeat):
+        timings = []
+        for query in QUERIES:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                search(query)
+            timings.append((time.perf_counter() - started) / repeat * 1000)
+        return timings
+
+    def handle(self, *args, **options):
+        with test_database():
+            total = self.fill_catalog(options['scale'])
+            self.stdout.write(f'Ингредиентов в каталоге: {total}')
+
+            index = IngredientIndex()
+            started = time.perf_counter()
+            index.build(version=None)
+            self.stdout.write(
+                'Построение индекса: '
+                f'{(time.perf_counter() - started) * 1000:.0f} мс'
+            )
+            # версия уже проверена, в замере остаётся только поиск
+            index.ensure_fresh = lambda: None
+
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+            database = self.measure(
+                # тот же порядок и предел, что у индекса
+                lambda query: list(
+                    Ingredient.objects.filter(
+                        name__istartswith=query
+                    ).order_by(
+                        Lower('name'), 'name', 'measurement_unit', 'pk'
+                    )[:limit]
+                ),
+                options['repeat'],
+            )
+            memory = self.measure(
+                lambda query: index.search(query, limit),
+                options['repeat'],
+            )
+
+        self.stdout.write(f'{"запрос":<12}{"БД, мс":>12}{"индекс, мс":>14}')
+        for query, db_time, index_time in zip(QUERIES, database, memory):
+            self.stdout.write(
+                f'{query:<12}{db_time:>12.2f}{index_time:>14.3f}'
+            )
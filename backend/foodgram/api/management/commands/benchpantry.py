@@ -0,0 +1,142 @@
+import random
+import statistics
+import time
+from contextlib import nullcontext
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+
+from api.management.testdb import test_database
+from api.pantry import PantryIndex
+from recipes.models import IngredientToRecipe, Recipe
+
+SIZES = (5, 10, 20)
+MISSING = (0, 2)
+
+
+def sql_match(ingredients, missing):
+    """Прежний способ: GROUP BY по всей таблице связей"""
+    return list(
+        IngredientToRecipe.objects.order_by().values('recipe').annotate(
+            covered=Count('pk', filter=Q(ingredient__in=ingredients)),
+            total=Count('pk'),
+        ).filter(
+            covered__gt=0, total__lte=F('covered') + missing
+        ).order_by(
+            (Cast('covered', FloatField()) / F('total')).desc(),
+            (F('total') - F('covered')).asc(),
+            F('recipe').desc(),
+        ).values_list('recipe', 'covered', 'total')
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает подбор рецептов по имеющимся ингредиентам '
+        'через GROUP BY в БД и через обратный индекс в памяти'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Замерять на текущей БД, а не на временной',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='Число рецептов во временной БД',
+        )
+        parser.add_argument('--repeat', type=int, default=3)
+
+    @staticmethod
+    def measure(function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), result
+
+    @staticmethod
+    def cases():
+        """Наборы самых частых ингредиентов и случайные из первой
+        сотни по частоте"""
+        popular = list(
+            IngredientToRecipe.objects.values('ingredient').annotate(
+                total=Count('pk')
+            ).order_by('-total').values_list('ingredient', flat=True)[:100]
+        )
+        rng = random.Random(1)
+        for size in SIZES:
+            for label, ingredients in (
+                ('частые', popular[:size]),
+                ('случайные', rng.sample(popular, min(size, len(popular)))),
+            ):
+                for missing in MISSING:
+                    yield f'{size} {label}, missing={missing}', (
+                        ingredients, missing
+                    )
+
+    def handle(self, *args, **options):
+        context = nullcontext() if options['current_db'] else test_database()
+        with context:
+            if not options['current_db']:
+                call_command(
+                    'generatedata', users=options['recipes'] // 10,
+                    recipes=options['recipes'], favorites=0, seed=1,
+                    stdout=self.stdout,
+                )
+            if not IngredientToRecipe.objects.exists():
+                raise CommandError('В БД нет рецептов с ингредиентами')
+            index = PantryIndex()
+            started = time.perf_counter()
+            index.build(version=None, number=None)
+            size = sum(
+                len(values) * values.itemsize
+                for values in (
+                    index.ingredients, index.starts, index.totals,
+                    *(
+                        recipes for prefix in index.prefixes
+                        for recipes in prefix.values()
+                    ),
+                )
+            )
+            self.stdout.write(
+                f'Рецептов: {Recipe.objects.count()}\n'
+                'Построение индекса: '
+                f'{(time.perf_counter() - started) * 1000:.0f} мс, '
+                f'{size / 1024 / 1024:.1f} МБ'
+            )
+            # версия уже проверена, в замере остаётся только подбор
+            index.ensure_fresh = lambda: None
+
+            self.stdout.write(
+                f'{"GROUP BY, мс":>13}{"индекс, мс":>12}{"найдено":>10}'
+                '  набор'
+            )
+            for label, (ingredients, missing) in self.cases():
+                sql_ms, expected = self.measure(
+                    lambda: sql_match(ingredients, missing),
+                    options['repeat'],
+                )
+                index_ms, found = self.measure(
+                    lambda: index.match(ingredients, missing),
+                    options['repeat'],
+                )
+                if set(expected) != set(found):
+                    raise CommandError(f'{label}: результаты различаются')
+                self.stdout.write(
+                    f'{sql_ms:>13.1f}{index_ms:>12.1f}{len(found):>10}'
+                    f'  {label}'
+                )
+
+            pks = list(
+                Recipe.objects.order_by('?').values_list('pk', flat=True)[:20]
+            )
+            update_ms, _ = self.measure(
+                lambda: [index.reindex([pk]) for pk in pks], 1
+            )
+            self.stdout.write(
+                f'Переиндексация рецепта: {update_ms / len(pks):.1f} мс'
+            )
@@ -0,0 +1,108 @@
+import statistics
+import time
+from contextlib import nullcontext
+from itertools import combinations
+from types import SimpleNamespace
+
+import django_filters.rest_framework as filters
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.http import QueryDict
+
+from api.filters import RecipeFilter
+from api.management.testdb import test_database
+from api.views import RecipeViewSet
+from recipes.models import Favorite, Recipe, Tag
+from users.models import User
+
+PAGE_SIZE = 10
+
+
+class JoinRecipeFilter(RecipeFilter):
+    """Прежний фильтр: join с TagRecipe по slug и DISTINCT"""
+    tags = filters.ModelMultipleChoiceFilter(
+        queryset=Tag.objects.all(),
+        field_name='tags__slug',
+        to_field_name='slug',
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает фильтр рецептов по тегам через join с TagRecipe '
+        'и через маску тегов рецепта: первая страница и COUNT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Замерять на текущей БД, а не на временной',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='Число рецептов во временной БД',
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def measure(self, filterset_class, params, user, repeat):
+        request = SimpleNamespace(user=user)
+        view = RecipeViewSet(request=request)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = filterset_class(
+                data=QueryDict(params),
+                queryset=view.get_queryset(),
+                request=request,
+            ).qs.order_by('-pub_date', '-id').only('id', 'author', 'pub_date')
+            total = queryset.count()
+            page = [recipe.pk for recipe in queryset[:PAGE_SIZE]]
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), total, page
+
+    def cases(self):
+        slugs = list(Tag.objects.order_by('pk').values_list('slug', flat=True))
+        author = User.objects.annotate(
+            total=Count('recipes')
+        ).order_by('-total').first()
+        reader = Favorite.objects.values('user').annotate(
+            total=Count('pk')
+        ).order_by('-total').first()
+        reader = User.objects.get(pk=reader['user']) if reader else author
+        tag_sets = [[slug] for slug in slugs[:1]]
+        tag_sets += [list(pair) for pair in combinations(slugs, 2)][:1]
+        tag_sets.append(slugs)
+        for tags in tag_sets:
+            query = '&'.join(f'tags={slug}' for slug in tags)
+            yield query, author
+            yield f'{query}&author={author.pk}', author
+            yield f'{query}&is_favorited=1', reader
+
+    def handle(self, *args, **options):
+        context = nullcontext() if options['current_db'] else test_database()
+        with context:
+            if not options['current_db']:
+                call_command(
+                    'generatedata', users=options['recipes'] // 10,
+                    recipes=options['recipes'], favorites=20, seed=1,
+                    stdout=self.stdout,
+                )
+            if not Tag.objects.exists():
+                raise CommandError('В БД нет тегов')
+            self.stdout.write(
+                f'Рецептов: {Recipe.objects.count()}\n'
+                f'{"join, мс":>10}{"маска, мс":>11}{"найдено":>10}  запрос'
+            )
+            for params, user in self.cases():
+                join_ms, join_total, join_page = self.measure(
+                    JoinRecipeFilter, params, user, options['repeat']
+                )
+                mask_ms, total, page = self.measure(
+                    RecipeFilter, params, user, options['repeat']
+                )
+                if (join_total, join_page) != (total, page):
+                    raise CommandError(f'{params}: результаты различаются')
+                self.stdout.write(
+                    f'{join_ms:>10.1f}{mask_ms:>11.1f}{total:>10}  {params}'
+                )
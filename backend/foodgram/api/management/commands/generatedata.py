@@ -0,0 +1,337 @@
+import os
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api import cache
+from recipes.counters import recount_all
+from recipes.feed import rebuild_feeds
+from recipes.ingredient_loader import load_ingredients
+from recipes.models import (Favorite, FeedEntry, Ingredient,
+                            IngredientToRecipe, Recipe, ShoppingCart, Tag,
+                            TagRecipe)
+from recipes.search import rebuild_search_index
+from recipes.tag_masks import bits_mask
+from users.models import Subscribe, User
+
+ING_PATH = os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv')
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей')
+LAST_NAMES = ('Иванова', 'Петров', 'Смирнова', 'Кузнецов', 'Попова')
+WORDS = (
+    'домашний', 'быстрый', 'летний', 'пряный', 'сливочный', 'пирог',
+    'суп', 'салат', 'рагу', 'запеканка', 'соус', 'с травами',
+)
+
+
+class Zipf:
+    """Выбор элементов с вероятностью ~ 1 / rank ** exponent;
+    ранги назначаются элементам случайно"""
+
+    def __init__(self, rng, items, exponent):
+        self.rng = rng
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)
+        ))
+
+    def choices(self, k):
+        return self.rng.choices(
+            self.items, cum_weights=self.cum_weights, k=k
+        )
+
+    def sample(self, k):
+        """k различных элементов (не больше, чем есть)"""
+        k = min(k, len(self.items))
+        if k * 2 > len(self.items):
+            # редкие элементы почти не выпадают, выборка почти
+            # всего списка по весам заняла бы слишком много попыток
+            return set(self.rng.sample(self.items, k))
+        result = set()
+        while len(result) < k:
+            result.update(self.choices(k - len(result)))
+        return result
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_rows(model, fields, rows):
+    """Вставка строк без создания объектов моделей;
+    значения должны быть уже приведены к формату БД"""
+    ops = connection.ops
+    table = ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+    sql = f'INSERT INTO {table} ({columns}) VALUES '
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            from psycopg2.extras import execute_values
+            execute_values(cursor.cursor, sql + '%s', rows, page_size=1000)
+        else:
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(f'{sql}({placeholders})', rows)
+
+
+def last_id(model):
+    return model.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 0
+
+
+def created_ids(model, after, count):
+    """id только что вставленных строк: БД выдаёт их подряд после after"""
+    return list(
+        model.objects.filter(pk__gt=after).order_by('pk').values_list(
+            'pk', flat=True
+        )[:count]
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет БД синтетическими пользователями, рецептами, '
+        'избранным, списками покупок и подписками с неравномерной '
+        '(по закону Ципфа) популярностью'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее число рецептов в избранном у пользователя',
+        )
+        parser.add_argument(
+            '--cart', type=float, default=5,
+            help='Среднее число рецептов в списке покупок',
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=10,
+            help='Среднее число подписок пользователя',
+        )
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='Показатель закона Ципфа для популярности',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--prefix', default='synthetic',
+            help='Префикс имён создаваемых пользователей',
+        )
+        parser.add_argument(
+            '--password', default='synthetic-password',
+            help='Пароль всех создаваемых пользователей',
+        )
+
+    def stage(self, message):
+        self.stdout.write(
+            f'[{time.perf_counter() - self.started:7.1f} с] {message}'
+        )
+
+    def count(self, average):
+        """Число связей у пользователя: в среднем average,
+        у немногих - намного больше"""
+        return int(self.rng.expovariate(1 / average)) if average else 0
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом "{prefix}" уже есть, '
+                'укажите другой --prefix'
+            )
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.exponent = options['exponent']
+        self.started = time.perf_counter()
+        if connection.vendor == 'sqlite':
+            # надёжность записи генератору не нужна: без fsync
+            # и с большим кэшем страниц вставка в разы быстрее
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+                cursor.execute('PRAGMA cache_size = -262144')
+
+        ingredients = self.ensure_catalog()
+        tags = self.ensure_tags()
+        users = self.create_users(
+            prefix, options['users'], options['password']
+        )
+        self.stage(f'Пользователи: {len(users)}')
+        recipes = self.create_recipes(
+            options['recipes'], users, tags, ingredients
+        )
+        self.stage(f'Рецепты: {len(recipes)}')
+        rebuild_search_index(Recipe)
+        self.stage('Поисковый индекс построен')
+        recipes_popularity = Zipf(self.rng, recipes, self.exponent)
+        for model, average in (
+            (Favorite, options['favorites']),
+            (ShoppingCart, options['cart']),
+        ):
+            total = self.create_links(
+                model, users, recipes_popularity, average
+            )
+            self.stage(f'{model._meta.verbose_name}: {total}')
+        total = self.create_subscriptions(users, options['subscriptions'])
+        self.stage(f'Подписки: {total}')
+
+        with transaction.atomic():
+            recount_all(Recipe, User, Favorite, Subscribe)
+        self.stage('Счётчики пересчитаны')
+        with transaction.atomic():
+            total = rebuild_feeds(FeedEntry, User, Subscribe)
+        self.stage(f'Записи лент подписок: {total}')
+        # bulk_create не отправляет сигналы, кэш сбрасывается вручную
+        cache.invalidate_all_recipes()
+        cache.bump_version('recipe_list')
+        cache.bump_version('recipe_ingredients')
+
+    def ensure_catalog(self):
+        if not Ingredient.objects.exists():
+            with open(ING_PATH, newline='', encoding='UTF-8') as file:
+                load_ingredients(file, 'csv')
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        self.stage(f'Ингредиенты в каталоге: {len(ingredients)}')
+        return Zipf(self.rng, ingredients, self.exponent)
+
+    def ensure_tags(self):
+        if not Tag.objects.exists():
+            # bulk_create не вызывает сигналы: биты маски задаются здесь
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug, bit=bit)
+                for bit, (name, color, slug) in enumerate(TAGS)
+            )
+        # id тега -> бит в маске тегов рецепта
+        return dict(Tag.objects.order_by('pk').values_list('pk', 'bit'))
+
+    def create_users(self, prefix, total, password):
+        password = make_password(password)
+        ids = []
+        for numbers in chunks(range(total), self.batch_size):
+            after = last_id(User)
+            users = User.objects.bulk_create(
+                User(
+                    username=f'{prefix}{number}',
+                    email=f'{prefix}{number}@example.com',
+                    first_name=self.rng.choice(FIRST_NAMES),
+                    last_name=self.rng.choice(LAST_NAMES),
+                    password=password,
+                )
+                for number in numbers
+            )
+            ids.extend(created_ids(User, after, len(users)))
+        return ids
+
+    def create_recipes(self, total, users, tags, ingredients):
+        """Рецепты вставляются без объектов моделей: bulk_create
+        на миллионе строк тратит большую часть времени на ORM"""
+        authors = Zipf(self.rng, users, self.exponent)
+        pub_date = Recipe._meta.get_field('pub_date')
+        no_variants = Recipe._meta.get_field(
+            'image_variants'
+        ).get_db_prep_save({}, connection)
+        # даты публикации равномерно за последний год по возрастанию id
+        start = timezone.now() - timedelta(days=365)
+        step = timedelta(days=365) / total
+        ids = []
+        for numbers in chunks(range(total), self.batch_size):
+            after = last_id(Recipe)
+            recipe_tags = [
+                self.rng.sample(list(tags), self.rng.randint(1, len(tags)))
+                for _ in numbers
+            ]
+            with transaction.atomic():
+                insert_rows(Recipe, (
+                    'author', 'pub_date', 'name', 'image', 'text',
+                    'cooking_time', 'favorites_count', 'image_variants',
+                    'tags_mask',
+                ), [
+                    (
+                        author,
+                        pub_date.get_db_prep_save(
+                            start + step * number, connection
+                        ),
+                        ' '.join(self.rng.sample(WORDS, 3)).capitalize(),
+                        '',
+                        f'Синтетический рецепт №{number}',
+                        self.rng.randint(5, 180),
+                        0,
+                        no_variants,
+                        bits_mask(tags[tag] for tag in chosen),
+                    )
+                    for number, author, chosen in zip(
+                        numbers, authors.choices(len(numbers)), recipe_tags
+                    )
+                ])
+                recipe_ids = created_ids(Recipe, after, len(numbers))
+                insert_rows(TagRecipe, ('recipe', 'tag'), [
+                    (recipe, tag)
+                    for recipe, chosen in zip(recipe_ids, recipe_tags)
+                    for tag in chosen
+                ])
+                insert_rows(
+                    IngredientToRecipe, ('recipe', 'ingredient', 'amount'), [
+                        (recipe, ingredient, self.rng.randint(1, 500))
+                        for recipe in recipe_ids
+                        for ingredient in ingredients.sample(
+                            self.rng.randint(5, 30)
+                        )
+                    ]
+                )
+            ids.extend(recipe_ids)
+        return ids
+
+    def create_links(self, model, users, recipes, average):
+        total = 0
+        for batch in chunks(users, self.batch_size):
+            rows = [
+                (user, recipe)
+                for user in batch
+                for recipe in recipes.sample(self.count(average))
+            ]
+            with transaction.atomic():
+                insert_rows(model, ('user', 'recipe'), rows)
+            total += len(rows)
+        return total
+
+    def create_subscriptions(self, users, average):
+        authors = Zipf(self.rng, users, self.exponent)
+        total = 0
+        for batch in chunks(users, self.batch_size):
+            rows = []
+            for user in batch:
+                subscriptions = authors.sample(self.count(average))
+                subscriptions.discard(user)
+                rows.extend((user, author) for author in subscriptions)
+            with transaction.atomic():
+                insert_rows(Subscribe, ('user', 'author'), rows)
+            total += len(rows)
+        return total
@@ -0,0 +1,165 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.management.testdb import test_database
+
+from recipes.models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Subscribe, User
+
+# Размеры тестовых наборов данных: число запросов на обоих должно совпадать
+SCALES = (2, 6)
+
+# (название, url, нужна ли авторизация)
+CHECKS = (
+    ('Список рецептов', '/api/recipes/?limit=100', False),
+    ('Список рецептов', '/api/recipes/?limit=100', True),
+    ('Рецепты по курсору', '/api/recipes/?cursor=&limit=100', True),
+    (
+        'Популярные рецепты по курсору',
+        '/api/recipes/?cursor=&limit=100&ordering=-favorites_count',
+        True
+    ),
+    ('Рецепты по тегам', '/api/recipes/?limit=100&tags={tags}', True),
+    ('Рецепты автора', '/api/recipes/?limit=100&author={author}', True),
+    ('Поиск рецептов', '/api/recipes/?limit=100&search=рецепты', True),
+    (
+        'Рецепты из имеющихся ингредиентов',
+        '/api/recipes/pantry/?limit=100&ingredients={ingredients}',
+        True
+    ),
+    ('Лента подписок', '/api/recipes/feed/?limit=100', True),
+    ('Избранное', '/api/recipes/?limit=100&is_favorited=1', True),
+    ('Список покупок', '/api/recipes/?limit=100&is_in_shopping_cart=1', True),
+    ('PDF списка покупок', '/api/recipes/download_shopping_cart/', True),
+    ('Рецепт', '/api/recipes/{recipe}/', False),
+    ('Рецепт', '/api/recipes/{recipe}/', True),
+    ('Ингредиенты', '/api/ingredients/', False),
+    ('Поиск ингредиентов', '/api/ingredients/?name=Ингр', True),
+    ('Теги', '/api/tags/', False),
+    ('Пользователи', '/api/users/?limit=100', True),
+    ('Пользователь', '/api/users/{author}/', True),
+    ('Текущий пользователь', '/api/users/me/', True),
+    ('Подписки', '/api/users/subscriptions/?limit=100', True),
+    (
+        'Подписки с рецептами',
+        '/api/users/subscriptions/?limit=100&recipes_limit=3',
+        True
+    ),
+    (
+        'Подписки по курсору',
+        '/api/users/subscriptions/?cursor=&recipes_limit=3',
+        True
+    ),
+)
+
+
+def fill_database(scale):
+    """Наполняет БД: scale авторов, тегов и ингредиентов,
+    у каждого автора scale рецептов со всеми тегами и ингредиентами"""
+    reader = User.objects.create_user(
+        username='reader',
+        email='reader@foodgram.test',
+        password='reader_password',
+        first_name='Читатель',
+        last_name='Читателев',
+    )
+    User.objects.bulk_create(
+        User(
+            username=f'author{i}',
+            email=f'author{i}@foodgram.test',
+            first_name='Автор',
+            last_name=str(i),
+        ) for i in range(scale)
+    )
+    authors = list(User.objects.exclude(pk=reader.pk))
+    Tag.objects.bulk_create(
+        Tag(name=f'Тег {i}', color=f'#0000{i:02d}', slug=f'tag{i}', bit=i)
+        for i in range(scale)
+    )
+    tags = list(Tag.objects.all())
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+        for i in range(scale)
+    )
+    ingredients = list(Ingredient.objects.all())
+
+    for author in authors:
+        Subscribe.objects.create(user=reader, author=author)
+        for i in range(scale):
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f'Рецепт {i} {author.username}',
+                text='Описание',
+                cooking_time=10,
+            )
+            recipe.tags.set(tags)
+            IngredientToRecipe.objects.bulk_create(
+                IngredientToRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+                for ingredient in ingredients
+            )
+            Favorite.objects.create(user=reader, recipe=recipe)
+            ShoppingCart.objects.create(user=reader, recipe=recipe)
+
+    return reader, {
+        'author': authors[0].pk,
+        'recipe': Recipe.objects.first().pk,
+        'ingredients': '&ingredients='.join(
+            str(ingredient.pk) for ingredient in ingredients
+        ),
+        'tags': '&tags='.join(tag.slug for tag in tags),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Проверяет, что число SQL-запросов к эндпоинтам API '
+            'не зависит от количества объектов на странице')
+
+    def count_queries(self, scale):
+        call_command('flush', interactive=False, verbosity=0)
+        reader, context = fill_database(scale)
+        token = Token.objects.create(user=reader)
+        clients = {
+            False: Client(),
+            True: Client(HTTP_AUTHORIZATION=f'Token {token.key}'),
+        }
+        counts = []
+        for name, url, auth in CHECKS:
+            # считаем запросы при пустом кэше
+            cache.clear()
+            token_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = clients[auth].get(url.format(**context))
+            if response.status_code != 200:
+                raise CommandError(
+                    f'{name} ({url}): статус {response.status_code}'
+                )
+            counts.append(len(queries))
+        return counts
+
+    def handle(self, *args, **options):
+        with test_database():
+            results = [self.count_queries(scale) for scale in SCALES]
+
+        failed = False
+        for (name, url, auth), counts in zip(CHECKS, zip(*results)):
+            ok = len(set(counts)) == 1
+            failed = failed or not ok
+            user = 'авторизован' if auth else 'аноним'
+            line = f'{name} ({user}) {url}: ' + ' / '.join(map(str, counts))
+            self.stdout.write(
+                self.style.SUCCESS(line) if ok else self.style.ERROR(line)
+            )
+
+        if failed:
+            raise CommandError(
+                'Число запросов растёт вместе с размером данных'
+            )
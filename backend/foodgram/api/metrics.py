@@ -0,0 +1,239 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# семейство метрик -> (тип, описание)
+FAMILIES = {
+    'foodgram_http_requests_total': (
+        'counter', 'Число запросов по view, методу и статусу ответа',
+    ),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса',
+    ),
+    'foodgram_http_response_size_bytes': (
+        'histogram', 'Размер тела ответа',
+    ),
+    'foodgram_db_duration_seconds': (
+        'histogram', 'Время SQL-запросов за один запрос',
+    ),
+    'foodgram_db_queries_total': (
+        'counter', 'Число SQL-запросов',
+    ),
+}
+HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            # ошибки (401, 403) отдаются как есть, в JSON
+            data = json.dumps(data, ensure_ascii=False)
+        return data.encode(self.charset)
+
+
+def view_name(request):
+    """Имя view для меток: класс и действие вьюсета
+    (RecipeViewSet.list, UserViewSet.subscriptions)"""
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    cls = getattr(func, 'cls', None)
+    if cls is None:
+        return f'{func.__module__}.{func.__name__}'
+    actions = getattr(func, 'actions', None) or {}
+    method = request.method.lower()
+    action = actions.get(method)
+    if action is None and method == 'head':
+        action = actions.get('get')
+    return f'{cls.__name__}.{action}' if action else cls.__name__
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', r'\\').replace('\n', r'\n')
+        .replace('"', r'\"')
+    )
+
+
+class MetricsStore:
+    """Счётчики процесса, которые периодически сбрасываются в свой файл.
+
+    Гистограммы хранятся как набор счётчиков _bucket, _sum и _count,
+    поэтому данные всех воркеров gunicorn складываются простым
+    суммированием файлов. Файлы завершившихся воркеров остаются
+    в каталоге, и счётчики не уменьшаются при их перезапуске"""
+
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.reset()
+        atexit.register(self.flush, force=True)
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.path = os.path.join(
+            self.directory, f'{self.pid}-{uuid.uuid4().hex}.json'
+        )
+        self.values = defaultdict(float)
+        self.flushed = time.monotonic()
+
+    def check_fork(self):
+        # воркер, созданный fork после загрузки приложения (--preload),
+        # не должен дописывать в файл родителя
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.check_fork()
+            self.values[key] += value
+
+    def observe(self, name, labels, value, buckets):
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            self.check_fork()
+            # пустые бакеты тоже нужны: без них histogram_quantile
+            # в Prometheus считает неверно
+            for bound in buckets:
+                self.values[(
+                    f'{name}_bucket',
+                    labels + (('le', format_value(bound)),),
+                )] += value <= bound
+            self.values[(
+                f'{name}_bucket', labels + (('le', '+Inf'),)
+            )] += 1
+            self.values[(f'{name}_sum', labels)] += value
+            self.values[(f'{name}_count', labels)] += 1
+
+    def flush(self, force=False):
+        """Атомарно переписывает файл процесса, не чаще flush_interval"""
+        with self.lock:
+            self.check_fork()
+            if not self.values:
+                return
+            now = time.monotonic()
+            if not force and now - self.flushed < self.flush_interval:
+                return
+            self.flushed = now
+            samples = [
+                [name, list(labels), value]
+                for (name, labels), value in self.values.items()
+            ]
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(
+            dir=self.directory, suffix='.tmp'
+        )
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(samples, file)
+        os.replace(temp_path, self.path)
+
+    def collect(self):
+        """Сумма счётчиков всех процессов: (имя, метки) -> значение"""
+        self.flush(force=True)
+        totals = defaultdict(float)
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return totals
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as file:
+                    samples = json.load(file)
+            except FileNotFoundError:
+                continue
+            for name, labels, value in samples:
+                totals[(name, tuple(map(tuple, labels)))] += value
+        return totals
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        families = defaultdict(list)
+        for (name, labels), value in self.collect().items():
+            family = name
+            for suffix in HISTOGRAM_SUFFIXES:
+                if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+                    family = name[:-len(suffix)]
+            families[family].append((name, labels, value))
+        lines = []
+        for family in sorted(families):
+            kind, description = FAMILIES.get(family, ('untyped', family))
+            lines.append(f'# HELP {family} {description}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels, value in sorted(
+                families[family], key=sample_order
+            ):
+                label_text = ','.join(
+                    f'{key}="{escape(label)}"' for key, label in labels
+                )
+                lines.append(f'{name}{{{label_text}}} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def sample_order(sample):
+    """Бакеты одной серии идут по возрастанию границы"""
+    name, labels, _ = sample
+    labels = dict(labels)
+    bound = labels.pop('le', None)
+    return (
+        sorted(labels.items()),
+        name,
+        float(bound) if bound is not None else 0,
+    )
+
+
+def record_request(request, response, duration, db_duration, db_queries):
+    method = request.method if request.method in HTTP_METHODS else 'other'
+    labels = {'view': view_name(request), 'method': method}
+    metrics.inc(
+        'foodgram_http_requests_total',
+        dict(labels, status=str(response.status_code)),
+    )
+    metrics.observe(
+        'foodgram_http_request_duration_seconds', labels, duration,
+        settings.METRICS_LATENCY_BUCKETS,
+    )
+    metrics.observe(
+        'foodgram_db_duration_seconds', labels, db_duration,
+        settings.METRICS_LATENCY_BUCKETS,
+    )
+    metrics.inc('foodgram_db_queries_total', labels, db_queries)
+    if response.streaming:
+        size = response.get('Content-Length')
+    else:
+        size = len(response.content)
+    if size is not None:
+        metrics.observe(
+            'foodgram_http_response_size_bytes', labels, int(size),
+            settings.METRICS_SIZE_BUCKETS,
+        )
+    metrics.flush()
+
+
+metrics = MetricsStore(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL)
@@ -0,0 +1,146 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from api.metrics import record_request
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Форма запроса без конкретных значений: списки IN и числа
+    заменяются, чтобы одинаковые запросы с разными id совпадали"""
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = NUMBER.sub('?', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+class QueryLog:
+    """Считает запросы, их время и формы через execute_wrapper"""
+
+    def __init__(self, shapes=True):
+        self.count = 0
+        self.duration = 0
+        self.shapes = shapes
+        self.fingerprints = Counter()
+        self.view_finished = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if self.shapes:
+                self.fingerprints[fingerprint(sql)] += 1
+
+
+@contextmanager
+def watch_queries(queries):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(queries))
+        yield
+
+
+class SQLInstrumentationMiddleware:
+    """Считает SQL-запросы каждого запроса, добавляет заголовок
+    Server-Timing и пишет в лог запросы, превысившие пороги.
+    Включается настройкой SQL_INSTRUMENTATION, иначе Django
+    исключает middleware из цепочки"""
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryLog()
+        request.sql_queries = queries
+        started = time.perf_counter()
+        with watch_queries(queries):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        view_finished = queries.view_finished or finished
+        db = queries.duration * 1000
+        serialize = max((view_finished - started) * 1000 - db, 0)
+        render = (finished - view_finished) * 1000
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={db:.1f};desc="{queries.count} SQL"',
+            f'serialize;dur={serialize:.1f}',
+            f'render;dur={render:.1f}',
+        ))
+        self.report(request, response, queries, db)
+        return response
+
+    def process_template_response(self, request, response):
+        """Вызывается до рендера ответа DRF: отсюда считается render"""
+        request.sql_queries.view_finished = time.perf_counter()
+        return response
+
+    @staticmethod
+    def report(request, response, queries, db):
+        repeated = [
+            (sql, count)
+            for sql, count in queries.fingerprints.most_common(3)
+            if count >= settings.SQL_INSTRUMENTATION_REPEATED
+        ]
+        if not (
+            repeated
+            or queries.count > settings.SQL_INSTRUMENTATION_MAX_QUERIES
+            or db > settings.SQL_INSTRUMENTATION_MAX_DB_MS
+        ):
+            return
+        shapes = repeated or queries.fingerprints.most_common(3)
+        logger.warning(
+            '%s %s -> %s: %s SQL, %.1f мс в БД%s',
+            request.method,
+            request.get_full_path(),
+            response.status_code,
+            queries.count,
+            db,
+            ''.join(f'\n  {count} x {sql}' for sql, count in shapes),
+        )
+
+
+class MetricsMiddleware:
+    """Собирает метрики каждого запроса для /api/metrics/.
+    Включается настройкой METRICS_ENABLED"""
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = getattr(request, 'sql_queries', None)
+        if queries is None:
+            # SQL уже считает SQLInstrumentationMiddleware, если включён
+            queries = QueryLog(shapes=False)
+            with watch_queries(queries):
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        record_request(
+            request,
+            response,
+            time.perf_counter() - started,
+            queries.duration,
+            queries.count,
+        )
+        return response
@@ -0,0 +1,201 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по курсору: страница выбирается условием
+    на поля сортировки (например, (pub_date, id)), без COUNT и OFFSET"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 10
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def seek_filter(ordering, values):
+        """Условие "строго после values" для заданной сортировки"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def sort_key(self, item):
+        return tuple(
+            getattr(item, field.lstrip('-')) for field in self.ordering
+        )
+
+    def encode_cursor(self, item, reverse):
+        values = list(self.sort_key(item))
+        cursor = json.dumps({'v': values, 'r': reverse}, default=str)
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, encoded):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def clean_values(self, queryset, values):
+        """Значения курсора, приведённые к типам полей сортировки"""
+        cleaned = []
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            try:
+                model_field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                model_field = queryset.query.annotations[name].output_field
+            try:
+                value = model_field.to_python(value)
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            cleaned.append(value)
+        return cleaned
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request)
+
+    def paginate_querysets(self, querysets, request):
+        """Страница из нескольких querysets с общими полями сортировки
+        (все в одном направлении): из каждого берётся не больше страницы,
+        результаты сливаются"""
+        self.request = request
+        page_size = self.get_page_size(request)
+        encoded = request.query_params.get(self.cursor_query_param)
+        values, reverse = (
+            self.decode_cursor(encoded) if encoded else (None, False)
+        )
+        if values is not None:
+            values = self.clean_values(querysets[0], values)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        results = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*ordering)
+            if values is not None:
+                queryset = queryset.filter(self.seek_filter(ordering, values))
+            results.extend(queryset[:page_size + 1])
+        if len(querysets) > 1:
+            results.sort(
+                key=self.sort_key, reverse=ordering[0].startswith('-')
+            )
+        has_more = len(results) > page_size
+        self.page = results[:page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class CustomPageNumberPagination(PageNumberPagination):
+    """Пагинация по номеру страницы. Если у вью задан keyset_ordering,
+    а в запросе есть параметр cursor (пустой - первая страница),
+    используется KeysetPagination"""
+    page_size_query_param = 'limit'
+    keyset = None
+    invalid_ordering_message = (
+        'Курсор не поддерживает сортировку по вычисляемому значению '
+        '{field}.'
+    )
+
+    def keyset_ordering(self, queryset, default):
+        """Сортировка курсора: заданная фильтрами (ordering) с последним
+        полем default для однозначности или default, если queryset
+        не отсортирован. Сортировку по вычисляемым значениям
+        (релевантность поиска) условие курсора не выражает"""
+        if not queryset.query.order_by:
+            return default
+        ordering = []
+        for field in queryset.query.order_by:
+            name = (
+                field.lstrip('-') if isinstance(field, str) else str(field)
+            )
+            try:
+                queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ValidationError({
+                    KeysetPagination.cursor_query_param:
+                        self.invalid_ordering_message.format(field=name),
+                })
+            ordering.append(field)
+        tiebreaker = default[-1]
+        if tiebreaker.lstrip('-') not in (
+            field.lstrip('-') for field in ordering
+        ):
+            ordering.append(tiebreaker)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', None)
+        if (
+            ordering and
+            KeysetPagination.cursor_query_param in request.query_params
+        ):
+            self.keyset = KeysetPagination(
+                self.keyset_ordering(queryset, ordering)
+            )
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
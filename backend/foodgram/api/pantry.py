@@ -0,0 +1,254 @@
+import bisect
+import gc
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import connection
+
+from api.cache import changes_number, get_version, read_changes
+from recipes.models import IngredientToRecipe
+
+# имя версии и журнала изменений ингредиентов рецептов в кэше
+INDEX_NAME = 'recipe_ingredients'
+# id в индексе - беззнаковые 32-битные
+ID_TYPE = 'I'
+BUILD_CHUNK_SIZE = 100000
+
+
+def zeros(typecode, length):
+    return array(typecode, bytes(array(typecode).itemsize * length))
+
+
+@contextmanager
+def gc_paused():
+    """Отключает сборщик циклов: кортежи строк из БД циклов
+    не образуют, а его проходы по миллионам объектов удваивают
+    время чтения"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class PantryIndex:
+    """Индекс ингредиентов рецептов в памяти процесса для подбора
+    рецептов по имеющимся ингредиентам.
+
+    Обратный индекс prefixes[k] хранит для ингредиента (его места
+    в порядке от редких к частым) отсортированный
+    массив id рецептов, у которых он k-й по редкости (k до
+    PANTRY_MAX_MISSING). У рецепта, которому не хватает не больше
+    missing ингредиентов, хотя бы один из missing + 1 самых редких есть
+    в наборе, поэтому кандидаты - объединение коротких массивов,
+    а длинные списки рецептов с частыми ингредиентами (соль, сахар)
+    не просматриваются. Сколько ингредиентов набора есть у кандидата,
+    считается по его ингредиентам: они лежат подряд в одном массиве.
+
+    Изменённые рецепты приходят из журнала 'recipe_ingredients' в кэше
+    и переиндексируются по одному. Индекс строится заново при смене
+    версии 'recipe_ingredients' (массовая загрузка), при пропуске
+    в журнале и при слишком длинном журнале"""
+
+    def __init__(self):
+        self.version = None
+        self.number = None
+        self.waiting_since = None
+        # порядок ингредиентов от редких к частым, неизменный до
+        # следующего построения: иначе префиксы рецептов разойдутся
+        self.rank = {}
+        self.prefixes = []
+        # ингредиенты рецептов (их места в rank), у каждого от редких
+        # к частым; начало и число ингредиентов рецепта - в массивах
+        # по id рецепта
+        self.ingredients = array(ID_TYPE)
+        self.starts = array(ID_TYPE)
+        self.totals = array('H')
+        # места в ingredients, освободившиеся при переиндексации
+        self.garbage = 0
+        self.lock = threading.Lock()
+
+    @property
+    def prefix_size(self):
+        return settings.PANTRY_MAX_MISSING + 1
+
+    def build(self, version, number):
+        links = IngredientToRecipe.objects.filter(
+            recipe__isnull=False, ingredient__isnull=False
+        ).order_by('recipe_id').values_list('recipe_id', 'ingredient_id')
+        # миллионы связей читаются пачками мимо ORM: создание
+        # кортежа на каждую строку дольше самого запроса
+        sql, params = links.query.sql_with_params()
+        recipes = array(ID_TYPE)
+        ingredients = array(ID_TYPE)
+        with gc_paused(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchmany(BUILD_CHUNK_SIZE)
+            while rows:
+                recipe_ids, ingredient_ids = zip(*rows)
+                recipes.extend(recipe_ids)
+                ingredients.extend(ingredient_ids)
+                rows = cursor.fetchmany(BUILD_CHUNK_SIZE)
+
+        frequencies = Counter(ingredients)
+        order = sorted(frequencies, key=lambda pk: (frequencies[pk], pk))
+        self.rank = {ingredient: rank for rank, ingredient in enumerate(order)}
+        self.ingredients = array(
+            ID_TYPE, map(self.rank.__getitem__, ingredients)
+        )
+        size = recipes[-1] + 1 if recipes else 0
+        self.starts = zeros(ID_TYPE, size)
+        self.totals = zeros('H', size)
+        self.prefixes = [
+            defaultdict(partial(array, ID_TYPE))
+            for _ in range(self.prefix_size)
+        ]
+        self.garbage = 0
+        start = 0
+        # рецепты идут по возрастанию id: массивы префиксов
+        # заполняются уже отсортированными
+        for recipe, total in Counter(recipes).items():
+            end = start + total
+            ranks = sorted(self.ingredients[start:end])
+            self.ingredients[start:end] = array(ID_TYPE, ranks)
+            self.starts[recipe] = start
+            self.totals[recipe] = total
+            for prefix, rank in zip(self.prefixes, ranks):
+                prefix[rank].append(recipe)
+            start = end
+        self.version = version
+        self.number = number
+        self.waiting_since = None
+
+    def unindex(self, pk):
+        total = self.totals[pk] if pk < len(self.totals) else 0
+        if not total:
+            return
+        start = self.starts[pk]
+        for prefix, rank in zip(
+            self.prefixes, self.ingredients[start:start + total]
+        ):
+            recipes = prefix[rank]
+            del recipes[bisect.bisect_left(recipes, pk)]
+        self.totals[pk] = 0
+        self.garbage += total
+
+    def compact(self):
+        """Сдвигает ингредиенты рецептов, убирая освободившиеся места"""
+        ingredients = array(ID_TYPE)
+        for recipe, total in enumerate(self.totals):
+            if total:
+                start = self.starts[recipe]
+                self.starts[recipe] = len(ingredients)
+                ingredients.extend(self.ingredients[start:start + total])
+        self.ingredients = ingredients
+        self.garbage = 0
+
+    def reindex(self, pks):
+        """Заново индексирует рецепты pks по данным из БД"""
+        for pk in pks:
+            self.unindex(pk)
+        rows = IngredientToRecipe.objects.filter(
+            recipe__in=pks, ingredient__isnull=False
+        ).order_by('recipe_id').values_list('recipe_id', 'ingredient_id')
+        for recipe, group in groupby(rows, key=itemgetter(0)):
+            ranks = []
+            for _, ingredient in group:
+                if ingredient not in self.rank:
+                    # новый ингредиент встаёт в конец порядка
+                    self.rank[ingredient] = len(self.rank)
+                ranks.append(self.rank[ingredient])
+            ranks.sort()
+            if recipe >= len(self.totals):
+                grow = recipe + 1 - len(self.totals)
+                self.starts.extend(zeros(ID_TYPE, grow))
+                self.totals.extend(zeros('H', grow))
+            self.starts[recipe] = len(self.ingredients)
+            self.totals[recipe] = len(ranks)
+            self.ingredients.extend(ranks)
+            for prefix, rank in zip(self.prefixes, ranks):
+                bisect.insort(prefix[rank], recipe)
+        if self.garbage > len(self.ingredients) // 2:
+            self.compact()
+
+    def apply_changes(self, number):
+        """Переиндексирует рецепты из записей журнала до number.
+        Чтение останавливается на первой отсутствующей записи: её могли
+        ещё не дописать. Запись, которой нет дольше PANTRY_CHANGES_WAIT
+        секунд, считается вытесненной, и индекс строится заново"""
+        numbers = range(self.number + 1, number + 1)
+        entries = read_changes(INDEX_NAME, numbers)
+        changed = set()
+        for current in numbers:
+            if current not in entries:
+                break
+            changed.update(entries[current])
+            self.number = current
+        if changed:
+            self.reindex(changed)
+        if self.number == number:
+            self.waiting_since = None
+        elif self.waiting_since is None:
+            self.waiting_since = time.monotonic()
+        elif (
+            time.monotonic() - self.waiting_since
+            > settings.PANTRY_CHANGES_WAIT
+        ):
+            self.build(self.version, number)
+
+    def ensure_fresh(self):
+        version = get_version(INDEX_NAME)
+        number = changes_number(INDEX_NAME)
+        if (
+            version != self.version or
+            number < self.number or
+            number - self.number > settings.PANTRY_REPLAY_LIMIT
+        ):
+            self.build(version, number)
+        elif number != self.number:
+            self.apply_changes(number)
+
+    def match(self, ingredients, missing=0):
+        """Рецепты, которым из ingredients не хватает не больше missing
+        ингредиентов (не больше PANTRY_MAX_MISSING):
+        [(id, есть ингредиентов, всего)] по убыванию доли имеющихся,
+        затем по числу недостающих и от новых к старым"""
+        found = []
+        with self.lock:
+            self.ensure_fresh()
+            ranks = {
+                self.rank[ingredient] for ingredient in ingredients
+                if ingredient in self.rank
+            }
+            candidates = set().union(*(
+                prefix.get(rank, ())
+                for prefix in self.prefixes[:missing + 1]
+                for rank in ranks
+            ))
+            limit = len(ranks) + missing
+            for recipe in candidates:
+                total = self.totals[recipe]
+                if total > limit:
+                    continue
+                start = self.starts[recipe]
+                count = len(ranks.intersection(
+                    self.ingredients[start:start + total]
+                ))
+                if total - count <= missing:
+                    found.append((recipe, count, total))
+        found.sort(key=lambda item: (
+            item[1] * -1.0 / item[2], item[2] - item[1], -item[0]
+        ))
+        return found
+
+
+pantry_index = PantryIndex()
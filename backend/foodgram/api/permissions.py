@@ -0,0 +1,22 @@
+import hmac
+
+from django.conf import settings
+from rest_framework import permissions
+
+
+class IsAdminOrMetricsToken(permissions.BasePermission):
+    """Доступ к метрикам: администратору или сборщику
+    с заголовком Authorization: Bearer <METRICS_TOKEN>"""
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        if not token:
+            return False
+        keyword, _, value = request.META.get(
+            'HTTP_AUTHORIZATION', ''
+        ).partition(' ')
+        return keyword == 'Bearer' and hmac.compare_digest(
+            value.strip().encode(), token.encode()
+        )
@@ -1,11 +1,18 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes import images
+from recipes.models import (Favorite, ImageUpload, Ingredient,
+                            IngredientToRecipe, Recipe, ShoppingCart,
+                            ShoppingListJob, Tag)
 from users.models import Subscribe, User
 
 
@@ -24,6 +31,8 @@ class UserSerializer(DjoserUserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -48,6 +57,19 @@ class IngredietToRecipeSerializer(serializers.ModelSerializer):
         return obj.ingredient.name
 
 
+class IngredientToRecipeReadSerializer(serializers.ModelSerializer):
+    """Ингредиент рецепта с единицами измерения (только чтение)"""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = IngredientToRecipe
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
 class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -55,14 +77,34 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug',)
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии фото: {вариант: {формат: url}};
+    None, пока копии не готовы"""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for variant, names in value.items():
+            urls[variant] = {}
+            for extension, name in names.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[variant][extension] = url
+        return urls
+
+
 class RecipeReadOnlySerializer(serializers.ModelSerializer):
     """Сериалайзер для чтения одного / списка рецептов"""
     tags = TagSerializer(many=True)
-    ingredients = serializers.SerializerMethodField()
+    ingredients = IngredientToRecipeReadSerializer(many=True)
     author = UserSerializer()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField(required=False)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -76,40 +118,58 @@ class RecipeReadOnlySerializer(serializers.ModelSerializer):
             'cooking_time',
             'ingredients',
             'image',
+            'image_variants',
             'is_favorited',
             'is_in_shopping_cart',
         )
         read_only_fields = fields
 
-    def get_ingredients(self, obj):
-        ingredients_to_recipe = IngredientToRecipe.objects.filter(
-            recipe=obj
-        ).distinct()
-        ingredients = IngredietToRecipeSerializer(
-            ingredients_to_recipe, many=True
-        )
-
-        for link in ingredients.data:
-            link_model = IngredientToRecipe.objects.get(pk=link['id'])
-            measure = link_model.ingredient.measurement_unit
-            id = link_model.ingredient.id
-            link['measurement_unit'] = measure
-            link['id'] = id
-        return ingredients.data
-
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return obj.favorite.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return obj.shoppingcart.filter(user=request.user).exists()
 
 
+class AuthorSerializer(serializers.ModelSerializer):
+    """Автор рецепта без полей, зависящих от текущего пользователя"""
+
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'email', 'first_name', 'last_name',)
+
+
+class RecipeSnapshotSerializer(RecipeReadOnlySerializer):
+    """Общая для всех пользователей часть представления рецепта,
+    которая хранится в кэше"""
+    author = AuthorSerializer()
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id',
+            'author',
+            'pub_date',
+            'name',
+            'text',
+            'tags',
+            'cooking_time',
+            'ingredients',
+            'image',
+            'image_variants',
+        )
+
+
 class RecipeMiniSerializer(RecipeReadOnlySerializer):
     """read-only мини версия отображения рецепта с меньшим кол-вом полей"""
 
@@ -119,6 +179,7 @@ class RecipeMiniSerializer(RecipeReadOnlySerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
 
@@ -127,7 +188,6 @@ class UserIncludeSerializer(UserSerializer):
     """Дополнительный сериалайзер пользователя
     для использования в других вью / сериалайзерах"""
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -141,17 +201,18 @@ class UserIncludeSerializer(UserSerializer):
             'recipes',
             'recipes_count',
         )
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        read_only_fields = ('recipes_count',)
 
     def get_recipes(self, obj):
-        recipes_limit = (
-            self._context['request'].query_params.get('recipes_limit', False)
-        )
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = recipes[:abs(int(recipes_limit))]
+        """Рецепты автора: заранее выбранные во вью (page_recipes)
+        или первые recipes_limit из БД"""
+        if hasattr(obj, 'page_recipes'):
+            recipes = obj.page_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
 
         serializer = RecipeMiniSerializer(
             recipes,
@@ -173,7 +234,12 @@ class RecipeCUDSerializer(serializers.ModelSerializer):
         queryset=Tag.objects.all(),
         required=True,
     )
-    image = Base64ImageField(required=True)
+    image = Base64ImageField(required=False)
+    image_token = serializers.PrimaryKeyRelatedField(
+        queryset=ImageUpload.objects.all(),
+        write_only=True,
+        required=False,
+    )
     author = UserSerializer(read_only=True)
 
     class Meta:
@@ -186,6 +252,7 @@ class RecipeCUDSerializer(serializers.ModelSerializer):
             'cooking_time',
             'ingredients',
             'image',
+            'image_token',
             'author',
         )
 
@@ -198,14 +265,25 @@ class RecipeCUDSerializer(serializers.ModelSerializer):
             'cooking_time',
             'ingredients',
         ]
-        if self.context['request'].method == 'POST':
-            required_fields.append('image')
+        if data.get('image') and data.get('image_token'):
+            raise serializers.ValidationError(
+                'Передайте либо image, либо image_token!'
+            )
+        if self.context['request'].method == 'POST' and not (
+            data.get('image') or data.get('image_token')
+        ):
+            raise serializers.ValidationError('Не все поля заполнены!')
 
         for field in required_fields:
             if not (data.get(field)):
                 raise serializers.ValidationError('Не все поля заполнены!')
         return data
 
+    def validate_image_token(self, value):
+        if value.user_id != self.context['request'].user.pk:
+            raise serializers.ValidationError('Загрузка не найдена!')
+        return value
+
     def validate_tags(self, value):
         for tag in value:
             if value.count(tag) > 1:
@@ -229,6 +307,15 @@ class RecipeCUDSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(
                     'Введите количество ингредиента!'
                 )
+
+        ingredients = Ingredient.objects.in_bulk(recipe_ingredients)
+        missing = [id for id in recipe_ingredients if id not in ingredients]
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: ' + ', '.join(map(str, missing))
+            )
+        for ingredient in value:
+            ingredient['ingredient'] = ingredients[ingredient['id']]
         return value
 
     def validate_cooking_time(self, value):
@@ -241,44 +328,96 @@ class RecipeCUDSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """Вывод информации о тегах и ингредиентах
         при успешном создании рецепта"""
-        return RecipeReadOnlySerializer(instance).data
+        prefetch_related_objects(
+            [instance],
+            'author',
+            'tags',
+            Prefetch(
+                'ingredients',
+                queryset=IngredientToRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
+        return RecipeReadOnlySerializer(instance, context=self.context).data
 
     @staticmethod
     def ingredient_to_recipe_link(recipe, ingredient_to_recipe):
+        IngredientToRecipe.objects.bulk_create(
+            IngredientToRecipe(
+                ingredient=ingredient_data['ingredient'],
+                amount=ingredient_data['amount'],
+                recipe=recipe,
+            )
+            for ingredient_data in ingredient_to_recipe
+        )
 
-        ingredients_to_recipe_data = []
+    @staticmethod
+    def update_ingredient_links(recipe, ingredient_to_recipe):
+        """Добавляет новые, обновляет изменившиеся
+        и удаляет убранные ингредиенты рецепта"""
+        links = {
+            link.ingredient_id: link
+            for link in IngredientToRecipe.objects.filter(recipe=recipe)
+        }
+        new_links = []
+        changed_links = []
         for ingredient_data in ingredient_to_recipe:
-            amount = ingredient_data.pop('amount')
-            current_ingredient = Ingredient.objects.get(**ingredient_data)
-            ingredients_to_recipe_data.append(
-                IngredientToRecipe(
-                    ingredient=current_ingredient,
-                    amount=amount,
-                    recipe=recipe,
-                )
-            )
+            link = links.pop(ingredient_data['id'], None)
+            if link is None:
+                new_links.append(ingredient_data)
+            elif link.amount != ingredient_data['amount']:
+                link.amount = ingredient_data['amount']
+                changed_links.append(link)
+
+        if links:
+            IngredientToRecipe.objects.filter(
+                pk__in=[link.pk for link in links.values()]
+            ).delete()
+        if changed_links:
+            IngredientToRecipe.objects.bulk_update(changed_links, ['amount'])
+        if new_links:
+            RecipeCUDSerializer.ingredient_to_recipe_link(recipe, new_links)
 
-        IngredientToRecipe.objects.bulk_create(ingredients_to_recipe_data)
+    @staticmethod
+    def update_tags(recipe, tags):
+        current = set(recipe.tags.values_list('pk', flat=True))
+        new = {tag.pk for tag in tags}
+        if current - new:
+            recipe.tags.remove(*(current - new))
+        if new - current:
+            recipe.tags.add(*(new - current))
 
+    @staticmethod
+    def use_image_upload(validated_data):
+        """Подставляет фото, заранее загруженное по токену"""
+        upload = validated_data.pop('image_token', None)
+        if upload is not None:
+            validated_data['image'] = upload.image.name
+            upload.delete()
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredient_to_recipe = validated_data.pop('ingredients')
+        self.use_image_upload(validated_data)
         author = self.context['request'].user
         recipe = Recipe.objects.create(**validated_data, author=author)
         recipe.tags.set(tags)
         self.ingredient_to_recipe_link(recipe, ingredient_to_recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredient_to_recipe = validated_data.pop('ingredients')
-
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.all().delete()
-        self.ingredient_to_recipe_link(instance, ingredient_to_recipe)
-
-        return super().update(instance, validated_data)
+        self.use_image_upload(validated_data)
+        # теги меняют tags_mask через UPDATE, поэтому рецепт
+        # сохраняется раньше них
+        recipe = super().update(instance, validated_data)
+        self.update_tags(recipe, tags)
+        self.update_ingredient_links(recipe, ingredient_to_recipe)
+        return recipe
 
 
 class RecipeLinkSerializer(serializers.ModelSerializer):
@@ -314,6 +453,30 @@ class ShoppingCartSerializer(RecipeLinkSerializer):
         read_only_fields = fields
 
 
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для массового добавления / удаления связей"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_LINKS_LIMIT,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+class PantrySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS,
+    )
+    missing = serializers.IntegerField(
+        min_value=0, max_value=settings.PANTRY_MAX_MISSING, default=0
+    )
+
+
 class SubscribeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscribe
@@ -334,3 +497,33 @@ class SubscribeSerializer(serializers.ModelSerializer):
                 'Нельзя подписаться на этого пользователя!'
             )
         return data
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Загрузка фото рецепта отдельным multipart-запросом"""
+
+    class Meta:
+        model = ImageUpload
+        fields = ('token', 'image',)
+        read_only_fields = ('token',)
+
+    def create(self, validated_data):
+        images.purge_stale_uploads()
+        return super().create(validated_data)
+
+
+class ShoppingListJobSerializer(serializers.ModelSerializer):
+    """Статус фоновой генерации списка покупок"""
+    file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShoppingListJob
+        fields = ('id', 'status', 'created', 'file',)
+        read_only_fields = fields
+
+    def get_file(self, obj):
+        if obj.status != ShoppingListJob.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(
+            reverse('recipes-shopping-cart-job-file', args=(obj.pk,))
+        )
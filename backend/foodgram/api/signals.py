@@ -0,0 +1,171 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import cache
+from api.authentication import token_cache
+from recipes.models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.signals import (ingredients_bulk_loaded, links_bulk_created,
+                             links_bulk_deleted)
+from users.models import Subscribe, User
+
+# поля пользователя, которые попадают в представление рецепта
+AUTHOR_FIELDS = {'id', 'username', 'email', 'first_name', 'last_name'}
+
+
+def invalidate_recipes(pks):
+    transaction.on_commit(lambda: cache.invalidate_recipes(pks))
+
+
+def invalidate_all_recipes():
+    transaction.on_commit(cache.invalidate_all_recipes)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+def record_ingredient_changes(pks):
+    transaction.on_commit(
+        lambda: cache.record_changes('recipe_ingredients', pks)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_ingredients_changed(sender, instance, update_fields=None,
+                               **kwargs):
+    """API и админка меняют ингредиенты вместе с сохранением рецепта"""
+    if update_fields is None:
+        record_ingredient_changes([instance.pk])
+
+
+@receiver(post_save, sender=IngredientToRecipe)
+@receiver(post_delete, sender=IngredientToRecipe)
+def ingredient_link_changed(sender, instance, **kwargs):
+    record_ingredient_changes([instance.recipe_id])
+
+
+@receiver(post_save, sender=IngredientToRecipe)
+@receiver(post_delete, sender=IngredientToRecipe)
+@receiver(post_save, sender=Recipe.tags.through)
+@receiver(post_delete, sender=Recipe.tags.through)
+def recipe_link_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_recipes([instance.pk])
+    elif pk_set:
+        invalidate_recipes(list(pk_set))
+    else:
+        invalidate_all_recipes()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    invalidate_all_recipes()
+    transaction.on_commit(lambda: cache.bump_version('tags'))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    invalidate_all_recipes()
+    transaction.on_commit(lambda: cache.bump_version('ingredients'))
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    """Связи с рецептами обнуляются через UPDATE, без сигналов"""
+    transaction.on_commit(
+        lambda: cache.bump_version('recipe_ingredients')
+    )
+
+
+@receiver(ingredients_bulk_loaded)
+def ingredients_loaded(sender, **kwargs):
+    """Новые ингредиенты не входят ни в один рецепт,
+    поэтому кэш рецептов не сбрасывается"""
+    transaction.on_commit(lambda: cache.bump_version('ingredients'))
+
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def author_changed(sender, instance, created=False, update_fields=None,
+                   **kwargs):
+    if created:
+        return
+    if update_fields is not None and not AUTHOR_FIELDS & set(update_fields):
+        return
+    invalidate_recipes(
+        list(instance.recipes.values_list('pk', flat=True))
+    )
+
+
+def forget_tokens(keys):
+    transaction.on_commit(lambda: token_cache.delete_many(keys))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Выход через djoser удаляет токен"""
+    forget_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, update_fields=None,
+               **kwargs):
+    """Смена пароля, деактивация и правка профиля: в кэше
+    токенов не должен остаться прежний объект пользователя"""
+    if created:
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    forget_tokens(list(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    ))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def user_link_changed(sender, instance, **kwargs):
+    name = cache.user_version_name(instance.user_id)
+    transaction.on_commit(lambda: cache.bump_version(name))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorite_changed(sender, **kwargs):
+    """Избранное меняет favorites_count и порядок сортировки по нему"""
+    transaction.on_commit(lambda: cache.bump_version('recipe_favorites'))
+
+
+@receiver(links_bulk_created, sender=Favorite)
+@receiver(links_bulk_deleted, sender=Favorite)
+def favorites_bulk_changed(sender, ids, **kwargs):
+    if ids:
+        transaction.on_commit(
+            lambda: cache.bump_version('recipe_favorites')
+        )
+
+
+@receiver(links_bulk_created)
+@receiver(links_bulk_deleted)
+def user_links_bulk_changed(sender, user_id, ids, **kwargs):
+    name = cache.user_version_name(user_id)
+    transaction.on_commit(lambda: cache.bump_version(name))
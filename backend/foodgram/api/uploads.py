@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.files.uploadhandler import (SkipFile, StopUpload,
+                                             TemporaryFileUploadHandler)
+from django.http.multipartparser import \
+    MultiPartParser as DjangoMultiPartParser
+from django.http.multipartparser import MultiPartParserError
+from django.template.defaultfilters import filesizeformat
+from rest_framework import status
+from rest_framework.exceptions import (APIException, ParseError,
+                                       ValidationError)
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+IMAGE_FIELD = 'image'
+# запас на заголовки и границы частей multipart
+MULTIPART_OVERHEAD = 64 * 1024
+
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'upload_too_large'
+
+    def __init__(self):
+        super().__init__(
+            'Размер файла не должен превышать '
+            f'{filesizeformat(settings.IMAGE_UPLOAD_MAX_SIZE)}.'
+        )
+
+
+def sniff_image_format(header):
+    """Определяет формат картинки по первым байтам файла"""
+    for signature, image_format in SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет фото сразу во временный файл и прерывает загрузку,
+    как только файл превысил лимит или оказался не картинкой"""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        if field_name != IMAGE_FIELD:
+            raise SkipFile()
+        super().new_file(field_name, *args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and sniff_image_format(raw_data[:12]) is None:
+            self.error = ValidationError(
+                {IMAGE_FIELD: 'Поддерживаются JPEG, PNG, GIF и WebP.'}
+            )
+            raise StopUpload(connection_reset=True)
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.error = UploadTooLarge()
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+class ImageUploadParser(MultiPartParser):
+    """multipart-парсер для загрузки фото без чтения файла в память"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+        length = int(meta.get('CONTENT_LENGTH') or 0)
+        if length > settings.IMAGE_UPLOAD_MAX_SIZE + MULTIPART_OVERHEAD:
+            raise UploadTooLarge()
+        handler = ImageUploadHandler(request)
+        try:
+            parser = DjangoMultiPartParser(meta, stream, [handler], encoding)
+            data, files = parser.parse()
+        except MultiPartParserError as exc:
+            raise ParseError(f'Multipart form parse error - {exc}')
+        if handler.error is not None:
+            raise handler.error
+        return DataAndFiles(data, files)
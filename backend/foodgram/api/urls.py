@@ -15,11 +15,19 @@ router.register(
 )
 
 urlpatterns = [
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
     path(
         r'users/subscriptions/',
         views.UserViewSet.as_view({'get': 'subscriptions'}),
         name='subscriptions'
     ),
+    path(
+        r'users/subscribe/',
+        views.UserViewSet.as_view(
+            {'post': 'bulk_subscribe', 'delete': 'bulk_subscribe'}
+        ),
+        name='bulk_subscribe'
+    ),
     path('', include('djoser.urls')),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,36 +1,113 @@
-from django.db.models import Exists, OuterRef
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, F, Value, Window
+from django.db.models.functions import RowNumber
 from django.http import FileResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from api.filters import IngredientSearchFilter, RecipeFilter
-from api.serializers import (FavoriteSerializer, IngredientSerializer,
-                             RecipeCUDSerializer, RecipeMiniSerializer,
-                             RecipeReadOnlySerializer, ShoppingCartSerializer,
+from api.cache import get_page, recipe_page_key, recipe_representations
+from api.decorators import conditional
+from api.filters import USER_FILTERS, IngredientSearchFilter, RecipeFilter
+from api.metrics import PrometheusRenderer, metrics
+from api.pagination import CustomPageNumberPagination, KeysetPagination
+from api.pantry import pantry_index
+from api.permissions import IsAdminOrMetricsToken
+from api.serializers import (BulkIdsSerializer, FavoriteSerializer,
+                             ImageUploadSerializer, IngredientSerializer,
+                             PantrySerializer, RecipeCUDSerializer,
+                             RecipeMiniSerializer, RecipeReadOnlySerializer,
+                             ShoppingCartSerializer, ShoppingListJobSerializer,
                              SubscribeSerializer, TagSerializer,
                              UserIncludeSerializer, UserSerializer)
-from recipes import pdf_generator
-from recipes.models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
-                            ShoppingCart, Tag)
+from api.uploads import ImageUploadParser
+from recipes import pdf_generator, pdf_jobs
+from recipes.feed import feed_querysets
+from recipes.models import (Favorite, FeedEntry, Ingredient,
+                            IngredientToRecipe, Recipe, ShoppingCart,
+                            ShoppingListJob, Tag)
+from recipes.pdf_cache import pdf_cache, shopping_list_digest
+from recipes.signals import links_bulk_created, links_bulk_deleted
 from users.models import Subscribe, User
 
 
-class CustomPageNumberPagination(PageNumberPagination):
-    page_size_query_param = 'limit'
+@transaction.atomic
+def delete_links(links, user, ids):
+    """Удаляет связи пользователя links одним DELETE и отправляет
+    links_bulk_deleted с ids рецептов или авторов. QuerySet.delete()
+    выбрал бы строки и отправил post_delete на каждую, и число
+    запросов росло бы вместе с числом ids; на связи ничто
+    не ссылается, так что каскад не нужен"""
+    if not ids:
+        return
+    links._raw_delete(links.db)
+    links_bulk_deleted.send(sender=links.model, user_id=user.pk, ids=ids)
 
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPageNumberPagination
+    keyset_ordering = ('id',)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is None:
+            return None
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            raise ValidationError(
+                {'recipes_limit': 'Введите целое число.'}
+            )
+        if recipes_limit < 0:
+            raise ValidationError(
+                {'recipes_limit': 'Введите неотрицательное число.'}
+            )
+        return recipes_limit
+
+    @staticmethod
+    def attach_recipes(authors, recipes_limit):
+        """Одним запросом выбирает первые recipes_limit рецептов
+        каждого автора и сохраняет их в author.page_recipes"""
+        recipes = Recipe.objects.filter(author__in=authors)
+        if recipes_limit is not None:
+            ranked = recipes.order_by().annotate(
+                recipe_rank=Window(
+                    expression=RowNumber(),
+                    partition_by=F('author'),
+                    order_by=(F('pub_date').desc(), F('id').desc()),
+                )
+            )
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                f'WHERE ranked.recipe_rank <= %s '
+                f'ORDER BY ranked.recipe_rank',
+                params + (recipes_limit,)
+            )
+        else:
+            recipes = recipes.order_by('-pub_date', '-id')
+
+        page_recipes = {author.pk: [] for author in authors}
+        for recipe in recipes:
+            page_recipes[recipe.author_id].append(recipe)
+        for author in authors:
+            author.page_recipes = page_recipes[author.pk]
+
     @action(detail=True, methods=['post'])
     def subscribe(self, request, pk=None):
+        recipes_limit = self.get_recipes_limit()
         author = get_object_or_404(self.queryset, pk=pk)
         serializer = SubscribeSerializer(
             context={
@@ -46,7 +123,8 @@ class UserViewSet(viewsets.ModelViewSet):
         )
         headers = self.get_success_headers(serializer.data)
         response = UserIncludeSerializer(
-            author, context={'request': request}
+            author,
+            context={'request': request, 'recipes_limit': recipes_limit}
         )
         return Response(
             response.data, status=status.HTTP_201_CREATED, headers=headers
@@ -60,56 +138,204 @@ class UserViewSet(viewsets.ModelViewSet):
         ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post', 'delete'], url_path='subscribe')
+    def bulk_subscribe(self, request):
+        """Подписка / отписка на несколько авторов одним запросом"""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+
+        authors = set(
+            User.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        subscribed = set(
+            Subscribe.objects.filter(
+                user=user, author__in=ids
+            ).values_list('author_id', flat=True)
+        )
+        results = []
+        if request.method == 'POST':
+            new = []
+            for pk in ids:
+                if pk not in authors:
+                    result = 'not_found'
+                elif pk == user.pk:
+                    result = 'invalid'
+                elif pk in subscribed:
+                    result = 'exists'
+                else:
+                    result = 'added'
+                    new.append(pk)
+                results.append({'id': pk, 'status': result})
+            Subscribe.objects.bulk_create(
+                (Subscribe(user=user, author_id=pk) for pk in new),
+                ignore_conflicts=True,
+            )
+            links_bulk_created.send(
+                sender=Subscribe, user_id=user.pk, ids=new
+            )
+        else:
+            delete_links(
+                Subscribe.objects.filter(user=user, author__in=subscribed),
+                user,
+                list(subscribed),
+            )
+            for pk in ids:
+                if pk not in authors:
+                    result = 'not_found'
+                elif pk in subscribed:
+                    result = 'removed'
+                else:
+                    result = 'absent'
+                results.append({'id': pk, 'status': result})
+        return Response({'results': results})
+
     @action(detail=False, methods=['get'])
     def subscriptions(self, request):
+        recipes_limit = self.get_recipes_limit()
         subscribtions = self.queryset.filter(
             subscribed__user=self.request.user
-        )
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id')
         page = self.paginate_queryset(subscribtions)
-
-        if not page:
-            serializer = UserIncludeSerializer(
-                subscribtions, many=True, context={'request': request}
-            )
-            return Response(serializer.data)
+        authors = list(subscribtions if page is None else page)
+        self.attach_recipes(authors, recipes_limit)
 
         serializer = UserIncludeSerializer(
-            page, many=True, context={'request': request}
+            authors,
+            many=True,
+            context={'request': request, 'recipes_limit': recipes_limit}
         )
+        if page is None:
+            return Response(serializer.data)
         return self.get_paginated_response(serializer.data)
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count')
     pagination_class = CustomPageNumberPagination
+    keyset_ordering = ('-pub_date', '-id')
 
     def get_queryset(self):
-        if self.request.user.is_anonymous:
-            return Recipe.objects.all()
+        # флаги пользователя берутся из кэшированных наборов id,
+        # а не из подзапросов Exists
+        return Recipe.objects.all()
 
-        user_favorited = Favorite.objects.filter(
-            recipe=OuterRef('pk'),
-            user=self.request.user,
+    @conditional('recipes', 'recipe_list', per_user=True)
+    def list(self, request, *args, **kwargs):
+        """Страница с id рецептов одна на всех в общем кэше, рецепты
+        собираются из кэша, флаги - из наборов id пользователя"""
+        key = recipe_page_key(
+            request,
+            per_user=any(
+                name in request.query_params for name in USER_FILTERS
+            ),
         )
-        user_shoppingcart = ShoppingCart.objects.filter(
-            recipe=OuterRef('pk'),
-            user=self.request.user,
+        page = get_page(key, lambda: self.build_page(request))
+        if isinstance(page, list):
+            # без limit список не разбивается на страницы
+            return Response(recipe_representations(page, request))
+        page = dict(page)
+        page['results'] = recipe_representations(page['results'], request)
+        return Response(page)
+
+    def build_page(self, request):
+        # поля сортировок нужны курсору страницы
+        queryset = self.filter_queryset(self.get_queryset()).only(
+            'id', 'pub_date', 'favorites_count'
         )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return [recipe.pk for recipe in queryset]
+        return self.get_paginated_response(
+            [recipe.pk for recipe in page]
+        ).data
 
-        queryset = Recipe.objects.annotate(
-            is_favorited=Exists(user_favorited)
-        ).annotate(
-            is_in_shopping_cart=Exists(user_shoppingcart)
+    @conditional('recipes', 'recipe_list', per_user=True)
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        return Response(recipe_representations([recipe.pk], request)[0])
+
+    @action(detail=False, permission_classes=(permissions.IsAuthenticated,))
+    @conditional('recipes', 'recipe_list', per_user=True)
+    def feed(self, request):
+        """Рецепты авторов из подписок от новых к старым, страницы
+        по курсору. Страница с id рецептов кэшируется, как в list"""
+        key = recipe_page_key(request, per_user=True)
+        page = dict(get_page(key, lambda: self.build_feed_page(request)))
+        page['results'] = recipe_representations(page['results'], request)
+        return Response(page)
+
+    @staticmethod
+    def build_feed_page(request):
+        paginator = KeysetPagination(('-pub_date', '-recipe_id'))
+        page = paginator.paginate_querysets(
+            feed_querysets(FeedEntry, Recipe, User, request.user.pk),
+            request,
+        )
+        return paginator.get_paginated_response(
+            [entry.recipe_id for entry in page]
+        ).data
+
+    @action(detail=False)
+    def pantry(self, request):
+        """Рецепты из имеющихся ингредиентов (?ingredients=1&ingredients=2),
+        которым не хватает не больше missing ингредиентов, по убыванию
+        доли имеющихся. Подбор идёт по обратному индексу в памяти"""
+        serializer = PantrySerializer(data={
+            'ingredients': request.query_params.getlist('ingredients'),
+            'missing': request.query_params.get('missing', 0),
+        })
+        serializer.is_valid(raise_exception=True)
+        ingredients = set(serializer.validated_data['ingredients'])
+        found = pantry_index.match(
+            ingredients, serializer.validated_data['missing']
         )
-        return queryset
+        # без view пагинатор не переключается на курсор: порядок
+        # задаёт индекс, а не поля модели
+        page = self.paginator.paginate_queryset(found, request)
+        matches = {recipe: (count, total) for recipe, count, total in (
+            found if page is None else page
+        )}
+        data = recipe_representations(list(matches), request)
+        for representation in data:
+            count, total = matches[representation['id']]
+            representation['coverage'] = round(count / total, 3)
+            representation['missing_ingredients'] = [
+                ingredient for ingredient in representation['ingredients']
+                if ingredient['id'] not in ingredients
+            ]
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return RecipeReadOnlySerializer
         return RecipeCUDSerializer
 
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='images',
+        parser_classes=(ImageUploadParser,),
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def upload_image(self, request):
+        """Принимает фото multipart-запросом и возвращает токен
+        для поля image_token рецепта"""
+        serializer = ImageUploadSerializer(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @staticmethod
     def create_recipe_link(pk, request, link_serializer):
         data = {
@@ -139,6 +365,75 @@ class RecipeViewSet(viewsets.ModelViewSet):
         get_object_or_404(model, recipe=recipe, user=request.user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def bulk_recipe_links(request, model):
+        """Добавляет / удаляет связи пользователя с несколькими рецептами.
+        Для каждого id возвращается статус: added, exists, removed,
+        absent или not_found"""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+
+        recipes = set(
+            Recipe.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        linked = set(
+            model.objects.filter(
+                user=user, recipe__in=ids
+            ).values_list('recipe_id', flat=True)
+        )
+        results = []
+        if request.method == 'POST':
+            new = []
+            for pk in ids:
+                if pk not in recipes:
+                    result = 'not_found'
+                elif pk in linked:
+                    result = 'exists'
+                else:
+                    result = 'added'
+                    new.append(pk)
+                results.append({'id': pk, 'status': result})
+            model.objects.bulk_create(
+                (model(user=user, recipe_id=pk) for pk in new),
+                ignore_conflicts=True,
+            )
+            links_bulk_created.send(sender=model, user_id=user.pk, ids=new)
+        else:
+            delete_links(
+                model.objects.filter(user=user, recipe__in=linked),
+                user,
+                list(linked),
+            )
+            for pk in ids:
+                if pk not in recipes:
+                    result = 'not_found'
+                elif pk in linked:
+                    result = 'removed'
+                else:
+                    result = 'absent'
+                results.append({'id': pk, 'status': result})
+        return Response({'results': results})
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def bulk_favorite(self, request):
+        return self.bulk_recipe_links(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def bulk_shopping_cart(self, request):
+        return self.bulk_recipe_links(request, ShoppingCart)
+
     @action(detail=True, methods=['post'])
     def favorite(self, request, pk=None):
         return self.create_recipe_link(pk, request, FavoriteSerializer)
@@ -155,14 +450,86 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def delete_from_shopping_cart(self, request, pk=None):
         return self.delete_recipe_link(pk, request, ShoppingCart)
 
+    @staticmethod
+    def shopping_list_response(pdf, digest):
+        response = FileResponse(pdf, as_attachment=True, filename='test.pdf')
+        response['ETag'] = quote_etag(digest)
+        return response
+
     @action(detail=False)
     def download_shopping_cart(self, request):
-        recipes = Recipe.objects.filter(shoppingcart__user=self.request.user)
-        ingredients_to_recipes = IngredientToRecipe.objects.filter(
-            recipe__in=recipes
+        """PDF берётся из кэша по хэшу содержимого списка покупок.
+        Длинный список, которого нет в кэше, генерируется в фоне:
+        в ответ 202 и ссылка на статус задачи"""
+        shopping_list = pdf_generator.parse_data(
+            IngredientToRecipe.objects.filter(
+                recipe__shoppingcart__user=self.request.user
+            )
+        )
+        digest = shopping_list_digest(shopping_list)
+        response = get_conditional_response(
+            request, etag=quote_etag(digest)
+        )
+        if response is not None:
+            return response
+
+        pdf = pdf_cache.get(digest)
+        if pdf is None:
+            if len(shopping_list) > settings.SHOPPING_LIST_ASYNC_THRESHOLD:
+                job = pdf_jobs.enqueue(request.user, digest, shopping_list)
+                serializer = ShoppingListJobSerializer(
+                    job, context={'request': request}
+                )
+                return Response(
+                    serializer.data,
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': request.build_absolute_uri(
+                        reverse('recipes-shopping-cart-job', args=(job.pk,))
+                    )},
+                )
+            pdf = pdf_cache.get_or_render(
+                digest, lambda: pdf_generator.render(shopping_list)
+            )
+        return self.shopping_list_response(pdf, digest)
+
+    @action(
+        detail=False,
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>\d+)',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def shopping_cart_job(self, request, job_id=None):
+        jobs = ShoppingListJob.objects.filter(pk=job_id, user=request.user)
+        pdf_jobs.fail_stale(jobs)
+        job = get_object_or_404(jobs)
+        serializer = ShoppingListJobSerializer(
+            job, context={'request': request}
         )
-        pdf = pdf_generator.generate(ingredients_to_recipes)
-        return FileResponse(pdf, as_attachment=True, filename='test.pdf')
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>\d+)/file',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def shopping_cart_job_file(self, request, job_id=None):
+        jobs = ShoppingListJob.objects.filter(pk=job_id, user=request.user)
+        pdf_jobs.fail_stale(jobs)
+        job = get_object_or_404(jobs)
+        if job.status == ShoppingListJob.FAILED:
+            return Response(
+                {'errors': 'Не удалось сформировать список покупок'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if job.status == ShoppingListJob.PENDING:
+            serializer = ShoppingListJobSerializer(
+                job, context={'request': request}
+            )
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        pdf = pdf_cache.get_or_render(
+            job.digest, lambda: pdf_generator.render(job.content)
+        )
+        return self.shopping_list_response(pdf, job.digest)
 
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
@@ -172,8 +539,36 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ('^name',)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    @conditional('ingredients')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional('ingredients')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    @conditional('tags')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional('tags')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class MetricsView(APIView):
+    """Метрики всех воркеров в формате Prometheus"""
+    permission_classes = (IsAdminOrMetricsToken,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        return Response(
+            metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -35,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.SQLInstrumentationMiddleware',
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +88,18 @@ else:
         }
     }
 
+# Для нескольких воркеров gunicorn нужен общий для процессов бэкенд,
+# например django.core.cache.backends.filebased.FileBasedCache
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 
 AUTH_USER_MODEL = 'users.User'
 
@@ -111,7 +126,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
 }
 
@@ -147,6 +162,79 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 
 RECIPES_MODELS_NAMES_LENGTH = 200
+RECIPE_SNAPSHOT_TIMEOUT = 60 * 60 * 24
+# страницы списка рецептов сбрасываются при изменении рецептов,
+# таймаут ограничивает устаревание сортировки по популярности
+RECIPE_PAGE_TIMEOUT = 60 * 5
+INGREDIENT_SEARCH_LIMIT = 50
+# журналы изменений в кэше (обратный индекс ингредиентов рецептов)
+CHANGES_TIMEOUT = 60 * 60
+# подбор рецептов по имеющимся ингредиентам: размер набора, сколько
+# ингредиентов может не хватать, длина журнала, после которой индекс
+# строится заново, и сколько секунд ждать недописанную запись журнала
+PANTRY_MAX_INGREDIENTS = 100
+PANTRY_MAX_MISSING = 3
+PANTRY_REPLAY_LIMIT = 1000
+PANTRY_CHANGES_WAIT = 10
+# лента подписок: рецепты автора с FEED_FANOUT_LIMIT подписчиков
+# и больше не раскладываются по лентам, а выбираются при чтении;
+# при подписке в ленту попадают FEED_BACKFILL последних рецептов автора
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL = 100
+BULK_LINKS_LIMIT = 100
+SHOPPING_LIST_CACHE_DIR = os.getenv(
+    'SHOPPING_LIST_CACHE_DIR',
+    default=os.path.join(BASE_DIR, 'pdf_cache')
+)
+SHOPPING_LIST_CACHE_SIZE = 50 * 1024 * 1024
+# списки длиннее порога генерируются в фоне
+SHOPPING_LIST_ASYNC_THRESHOLD = 100
+SHOPPING_LIST_RENDER_WORKERS = 2
+SHOPPING_LIST_JOB_TTL = 60 * 60 * 24
+# задача, которая не завершилась за это время, создаётся заново
+SHOPPING_LIST_JOB_TIMEOUT = 60 * 5
+# варианты фото рецепта: имя -> максимальные ширина и высота
+RECIPE_IMAGE_VARIANTS = {
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+IMAGE_PROCESSING_WORKERS = 1
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', default=10 * 1024 * 1024)
+)
+IMAGE_UPLOAD_TTL = 60 * 60 * 24
+# учёт SQL-запросов каждого запроса и заголовок Server-Timing
+SQL_INSTRUMENTATION = (
+    os.getenv('SQL_INSTRUMENTATION', default=False) == 'True'
+)
+# пороги, после которых запрос попадает в лог
+SQL_INSTRUMENTATION_MAX_QUERIES = 20
+SQL_INSTRUMENTATION_MAX_DB_MS = 200
+# столько одинаковых по форме запросов - признак N+1
+SQL_INSTRUMENTATION_REPEATED = 5
+# метрики запросов для /api/metrics/
+METRICS_ENABLED = (os.getenv('METRICS_ENABLED', default=False) == 'True')
+# каталог, через который метрики складываются между воркерами gunicorn
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram_metrics')
+)
+METRICS_FLUSH_INTERVAL = 5
+# токен сборщика метрик (Authorization: Bearer <токен>)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+METRICS_SIZE_BUCKETS = (
+    1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+)
+# кэш токенов авторизации: число записей и время жизни в секундах
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+# псевдоним из CACHES для общего кэша токенов; с пустым значением
+# кэш живёт в памяти каждого воркера и выход или деактивацию
+# в одном воркере другие увидят только через TOKEN_CACHE_TTL
+TOKEN_CACHE_BACKEND = os.getenv('TOKEN_CACHE_BACKEND', 'default') or None
 USER_MODELS_FIELD_LENGTH = 150
 USER_MODELS_EMAIL_FIELD_LENGTH = 254
 
@@ -23,7 +23,7 @@ class RecipeAdmin(admin.ModelAdmin):
         'pub_date',
         'name',
         'get_ingredients',
-        'get_in_favorite_count',
+        'favorites_count',
     )
     inlines = [IngredientToRecipeInline, TagRecipeInline, ]
     filter_horizontal = ('tags',)
@@ -38,11 +38,6 @@ class RecipeAdmin(admin.ModelAdmin):
 
     get_ingredients.short_description = 'Ингредиенты'
 
-    def get_in_favorite_count(self, obj):
-        return obj.favorite.count()
-
-    get_in_favorite_count.short_description = 'В избранном'
-
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = (
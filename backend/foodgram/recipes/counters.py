@@ -0,0 +1,67 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+class DerivedFieldsMixin:
+    """Поля из DERIVED_FIELDS (счётчики и т.п.) вычисляются по другим
+    таблицам и меняются только атомарным UPDATE: save() уже
+    сохранённого объекта их не записывает, иначе устаревшие значения
+    в памяти затрут чужие изменения"""
+    DERIVED_FIELDS = ()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        values = [
+            value for value in values
+            if value[0].name not in self.DERIVED_FIELDS
+        ]
+        return super()._do_update(
+            base_qs, using, pk_val, values, update_fields, forced_update
+        )
+
+
+def actual_count(related_model, related_field):
+    """Подзапрос с реальным числом связанных строк"""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0
+    )
+
+
+def recount(model, counter, related_model, related_field):
+    """Исправляет расхождения счётчика counter у model
+    с числом related_model; возвращает число исправленных строк"""
+    actual = actual_count(related_model, related_field)
+    stale = model.objects.annotate(actual=actual).exclude(
+        **{counter: F('actual')}
+    )
+    # подзапросом, а не списком id: расхождений может быть больше,
+    # чем SQLite допускает параметров в одном запросе
+    count = stale.count()
+    if count:
+        model.objects.filter(pk__in=stale.values('pk')).update(
+            **{counter: actual}
+        )
+    return count
+
+
+def recount_all(Recipe, User, Favorite, Subscribe):
+    """Модели передаются параметрами, чтобы функцию
+    можно было вызвать и из миграции"""
+    return {
+        'Recipe.favorites_count': recount(
+            Recipe, 'favorites_count', Favorite, 'recipe'
+        ),
+        'User.recipes_count': recount(
+            User, 'recipes_count', Recipe, 'author'
+        ),
+        'User.subscribers_count': recount(
+            User, 'subscribers_count', Subscribe, 'author'
+        ),
+    }
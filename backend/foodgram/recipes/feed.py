@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import DateTimeField, F, IntegerField, Value, Window
+from django.db.models.functions import RowNumber
+
+# поля записи ленты в порядке столбцов INSERT ... SELECT
+ENTRY_FIELDS = ('user', 'recipe', 'author', 'pub_date')
+
+
+def insert_entries(FeedEntry, subscriptions, where='', params=()):
+    """Вставляет в ленты строки одним INSERT ... SELECT: подписчик
+    и автор из queryset подписок subscriptions, рецепт и дата
+    из его аннотаций feed_recipe и feed_date. Уже разложенные
+    рецепты пропускаются"""
+    ops = connection.ops
+    columns = ', '.join(
+        ops.quote_name(FeedEntry._meta.get_field(name).column)
+        for name in ENTRY_FIELDS
+    )
+    # столбцы аннотаций ORM ставит после полей модели,
+    # поэтому порядок задаёт внешний SELECT
+    sql, subscriptions_params = subscriptions.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{ops.insert_statement(ignore_conflicts=True)} '
+            f'{ops.quote_name(FeedEntry._meta.db_table)} ({columns}) '
+            'SELECT user_id, feed_recipe, author_id, feed_date '
+            f'FROM ({sql}) feed {where} '
+            f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+            subscriptions_params + tuple(params),
+        )
+
+
+def mark_popular(User, authors):
+    """Авторы с FEED_FANOUT_LIMIT подписчиков и больше переходят
+    на сборку ленты при чтении. Обратно автор переходит только
+    при rebuild_feeds: иначе рецепты, вышедшие за это время,
+    пропали бы из лент"""
+    User.objects.filter(
+        pk__in=authors,
+        fanout_on_read=False,
+        subscribers_count__gte=settings.FEED_FANOUT_LIMIT,
+    ).update(fanout_on_read=True)
+
+
+def fan_out(FeedEntry, Subscribe, recipe):
+    """Раскладывает рецепт в ленты подписчиков его автора"""
+    if recipe.author_id is None:
+        return
+    rows = Subscribe.objects.filter(
+        author=recipe.author_id, author__fanout_on_read=False
+    ).annotate(
+        feed_recipe=Value(recipe.pk, output_field=IntegerField()),
+        feed_date=Value(recipe.pub_date, output_field=DateTimeField()),
+    ).values('user_id', 'author_id', 'feed_recipe', 'feed_date')
+    insert_entries(FeedEntry, rows)
+
+
+def fill_feeds(FeedEntry, subscriptions):
+    """Добавляет по каждой подписке из queryset subscriptions
+    последние FEED_BACKFILL рецептов автора в ленту подписчика"""
+    ranked = subscriptions.filter(
+        author__fanout_on_read=False, author__recipes__isnull=False
+    ).order_by().annotate(
+        feed_recipe=F('author__recipes__id'),
+        feed_date=F('author__recipes__pub_date'),
+        feed_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('pk'),
+            order_by=(F('feed_date').desc(), F('feed_recipe').desc()),
+        ),
+    ).values(
+        'user_id', 'author_id', 'feed_recipe', 'feed_date', 'feed_rank'
+    )
+    insert_entries(
+        FeedEntry, ranked, 'WHERE feed_rank <= %s', [settings.FEED_BACKFILL]
+    )
+
+
+def prune_feed(FeedEntry, user_id, author_id):
+    prune_feeds(FeedEntry, user_id, [author_id])
+
+
+def prune_feeds(FeedEntry, user_id, author_ids):
+    """Убирает из ленты user_id рецепты авторов author_ids
+    одним DELETE"""
+    FeedEntry.objects.filter(user=user_id, author__in=author_ids).delete()
+
+
+def rebuild_feeds(FeedEntry, User, Subscribe):
+    """Заново отмечает популярных авторов и раскладывает ленты.
+    Модели передаются параметрами, чтобы функцию можно было вызвать
+    из миграции"""
+    limit = settings.FEED_FANOUT_LIMIT
+    User.objects.filter(
+        fanout_on_read=False, subscribers_count__gte=limit
+    ).update(fanout_on_read=True)
+    User.objects.filter(
+        fanout_on_read=True, subscribers_count__lt=limit
+    ).update(fanout_on_read=False)
+    FeedEntry.objects.all().delete()
+    fill_feeds(FeedEntry, Subscribe.objects.all())
+    return FeedEntry.objects.count()
+
+
+def feed_querysets(FeedEntry, Recipe, User, user_id):
+    """Источники ленты user_id с полями recipe_id и pub_date:
+    разложенные записи и рецепты популярных авторов из подписок,
+    которые выбираются при чтении"""
+    popular = list(User.objects.filter(
+        subscribed__user=user_id, fanout_on_read=True
+    ).values_list('pk', flat=True))
+    entries = FeedEntry.objects.filter(user=user_id).only(
+        'recipe', 'pub_date'
+    )
+    if not popular:
+        return [entries]
+    return [
+        # записи, разложенные до того, как автор стал популярным
+        entries.exclude(author__in=popular),
+        Recipe.objects.filter(author__in=popular).annotate(
+            recipe_id=F('id')
+        ).only('id', 'pub_date'),
+    ]
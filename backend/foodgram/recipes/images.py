@@ -0,0 +1,116 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import ImageUpload, Recipe
+from recipes.storage import file_digest
+
+logger = logging.getLogger(__name__)
+
+# WebP для современных клиентов и JPEG как запасной вариант
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+    thread_name_prefix='recipe-images',
+)
+
+
+def variant_name(digest, variant, extension):
+    return f'recipes/variants/{digest[:2]}/{digest}/{variant}.{extension}'
+
+
+def make_variants(name, storage):
+    """Создаёт уменьшенные копии фото; копии одинаковых
+    файлов лежат по одному пути и не пересоздаются"""
+    with storage.open(name) as original:
+        digest = file_digest(original)
+        variants = {
+            variant: {
+                extension: variant_name(digest, variant, extension)
+                for extension, _, _ in FORMATS
+            }
+            for variant in settings.RECIPE_IMAGE_VARIANTS
+        }
+        missing = [
+            (variant, extension, fmt, options)
+            for variant, names in variants.items()
+            for extension, fmt, options in FORMATS
+            if not default_storage.exists(names[extension])
+        ]
+        if not missing:
+            return variants
+        image = ImageOps.exif_transpose(Image.open(original))
+        image = image.convert('RGB')
+    resized = {}
+    for variant, extension, fmt, options in missing:
+        if variant not in resized:
+            resized[variant] = image.copy()
+            resized[variant].thumbnail(
+                settings.RECIPE_IMAGE_VARIANTS[variant], Image.LANCZOS
+            )
+        buffer = io.BytesIO()
+        resized[variant].save(buffer, fmt, **options)
+        default_storage.save(
+            variants[variant][extension], ContentFile(buffer.getvalue())
+        )
+    return variants
+
+
+def process_recipe_image(recipe_id):
+    """Заполняет image_variants рецепта"""
+    close_old_connections()
+    try:
+        recipe = Recipe.objects.filter(pk=recipe_id).first()
+        if recipe is None or not recipe.image or recipe.image_variants:
+            return
+        name = recipe.image.name
+        recipe.image_variants = make_variants(name, recipe.image.storage)
+        # фото могли заменить, пока готовились копии
+        if Recipe.objects.filter(pk=recipe_id, image=name).exists():
+            recipe.save(update_fields=['image_variants'])
+    except Exception:
+        logger.exception('Не удалось обработать фото рецепта %s', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue(recipe_id):
+    executor.submit(process_recipe_image, recipe_id)
+
+
+def purge_stale_uploads():
+    """Удаляет загрузки старше IMAGE_UPLOAD_TTL вместе с файлами.
+    Хранилище делит один файл между одинаковыми загрузками
+    и рецептами, поэтому удаляются только файлы, на которые
+    больше ничто не ссылается"""
+    stale = ImageUpload.objects.filter(
+        created__lt=timezone.now() - timedelta(
+            seconds=settings.IMAGE_UPLOAD_TTL
+        )
+    )
+    names = set(stale.values_list('image', flat=True))
+    if not names:
+        return
+    stale.delete()
+    used = set(
+        Recipe.objects.filter(image__in=names).values_list('image', flat=True)
+    ) | set(
+        ImageUpload.objects.filter(
+            image__in=names
+        ).values_list('image', flat=True)
+    )
+    storage = ImageUpload._meta.get_field('image').storage
+    for name in names - used:
+        storage.delete(name)
@@ -0,0 +1,16 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.db.models import Index
+
+
+class SearchVectorIndex(GinIndex):
+    """GIN-индекс поискового вектора на PostgreSQL. На других СУБД
+    вектор не заполняется и индекс создаётся обычным: SQLite
+    пересоздаёт таблицу рецептов вместе с индексами из Meta,
+    а USING gin не поддерживает"""
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return Index.create_sql(
+                self, model, schema_editor, using=using, **kwargs
+            )
+        return super().create_sql(model, schema_editor, using, **kwargs)
@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+import os
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from recipes.models import Ingredient
+from recipes.signals import ingredients_bulk_loaded
+
+CHUNK_SIZE = 64 * 1024
+
+
+def as_row(item):
+    if not isinstance(item, dict):
+        return None
+    return [item.get('name'), item.get('measurement_unit')]
+
+
+def read_csv(file):
+    """Строки CSV: название, единица измерения"""
+    for row in csv.reader(file):
+        yield row[:2] if len(row) >= 2 else None
+
+
+def read_json_lines(file):
+    """JSON Lines: по объекту на строку"""
+    for line in file:
+        if line.strip():
+            yield as_row(json.loads(line))
+
+
+def read_json_array(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('Ожидается JSON-массив')
+            started = True
+            position += 1
+            continue
+        if started and position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            if eof and not buffer.strip():
+                raise ValueError('JSON-массив не закрыт')
+            continue
+        position = end
+        yield item
+
+
+def read_json(file):
+    for item in read_json_array(file):
+        yield as_row(item)
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonl': read_json_lines,
+}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        return 'jsonl'
+    return extension
+
+
+def clean_rows(rows, stats):
+    """Убирает пробелы по краям и отбрасывает неполные
+    и слишком длинные строки"""
+    max_length = settings.RECIPES_MODELS_NAMES_LENGTH
+    for row in rows:
+        try:
+            name, measurement_unit = row
+            name = ' '.join(name.split())
+            measurement_unit = ' '.join(measurement_unit.split())
+        except (TypeError, ValueError, AttributeError):
+            stats['invalid'] += 1
+            continue
+        if not (name and measurement_unit) or max(
+            len(name), len(measurement_unit)
+        ) > max_length:
+            stats['invalid'] += 1
+            continue
+        yield name, measurement_unit
+
+
+def batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_batches_generic(batches, stats):
+    """Для SQLite и прочих БД: вставка батча одним executemany,
+    уже существующие строки пропускает сама БД"""
+    ops = connection.ops
+    sql = '{} {} ({}, {}) VALUES (%s, %s) {}'.format(
+        ops.insert_statement(ignore_conflicts=True),
+        ops.quote_name(Ingredient._meta.db_table),
+        ops.quote_name('name'),
+        ops.quote_name('measurement_unit'),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    with connection.cursor() as cursor:
+        for batch in batches:
+            keys = list(dict.fromkeys(batch))
+            stats['duplicates'] += len(batch) - len(keys)
+            cursor.executemany(sql, keys)
+            stats['inserted'] += cursor.rowcount
+            stats['existing'] += len(keys) - cursor.rowcount
+
+
+def load_batches_postgresql(batches, stats):
+    """Для PostgreSQL: COPY во временную таблицу и одна вставка
+    с ON CONFLICT DO NOTHING"""
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE ingredient_staging '
+            '(name text, measurement_unit text) ON COMMIT DROP'
+        )
+        staged = 0
+        for batch in batches:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            cursor.cursor.copy_expert(
+                'COPY ingredient_staging FROM STDIN WITH CSV', buffer
+            )
+            staged += len(batch)
+        cursor.execute(
+            'SELECT COUNT(*) FROM (SELECT DISTINCT name, measurement_unit '
+            'FROM ingredient_staging) distinct_rows'
+        )
+        unique = cursor.fetchone()[0]
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT DISTINCT name, measurement_unit FROM ingredient_staging '
+            'ON CONFLICT (name, measurement_unit) DO NOTHING'
+        )
+        inserted = cursor.rowcount
+    stats['duplicates'] += staged - unique
+    stats['existing'] += unique - inserted
+    stats['inserted'] += inserted
+
+
+def load_ingredients(file, file_format, batch_size=1000):
+    """Загружает каталог ингредиентов из открытого файла.
+    Повторная загрузка того же файла ничего не меняет.
+    Возвращает счётчики inserted, existing, duplicates, invalid"""
+    stats = Counter(inserted=0, existing=0, duplicates=0, invalid=0)
+    rows = clean_rows(READERS[file_format](file), stats)
+    if connection.vendor == 'postgresql':
+        load = load_batches_postgresql
+    else:
+        load = load_batches_generic
+    with transaction.atomic():
+        load(batches(rows, batch_size), stats)
+        if stats['inserted']:
+            ingredients_bulk_loaded.send(
+                sender=Ingredient, count=stats['inserted']
+            )
+    return stats
@@ -1,21 +1,45 @@
-import csv
+import os
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.core.management.base import BaseCommand, CommandError
 
+from recipes.ingredient_loader import READERS, detect_format, load_ingredients
 
-ING_PATH = str(settings.BASE_DIR) + '/data/ingredients.csv'
+ING_PATH = os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv')
 
 
 class Command(BaseCommand):
-    help = 'Загружает CSV с ингредиентами в БД проекта'
+    help = (
+        'Загружает каталог ингредиентов из CSV, JSON или JSON Lines; '
+        'уже существующие ингредиенты пропускаются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=ING_PATH)
+        parser.add_argument(
+            '--format',
+            choices=sorted(READERS),
+            help='Формат файла (по умолчанию - по расширению)',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
 
     def handle(self, *args, **options):
-        with open(ING_PATH, newline='', encoding='UTF-8') as ingredients:
-            reader = csv.reader(ingredients)
-            for row in reader:
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
+        path = options['path']
+        file_format = options['format'] or detect_format(path)
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        try:
+            with open(path, newline='', encoding='UTF-8') as file:
+                stats = load_ingredients(
+                    file, file_format, options['batch_size']
                 )
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        self.stdout.write(
+            f'Добавлено: {stats["inserted"]}, '
+            f'уже были в БД: {stats["existing"]}, '
+            f'повторы в файле: {stats["duplicates"]}, '
+            f'пропущено некорректных строк: {stats["invalid"]}'
+        )
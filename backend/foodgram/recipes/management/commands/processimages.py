@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии фото рецептов, у которых их ещё нет'
+
+    def handle(self, *args, **options):
+        recipe_ids = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).filter(image_variants={}).values_list('id', flat=True)
+        count = 0
+        for recipe_id in recipe_ids.iterator():
+            process_recipe_image(recipe_id)
+            count += 1
+        self.stdout.write(f'Обработано фото: {count}')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import rebuild_feeds
+from recipes.models import FeedEntry
+from users.models import Subscribe, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново раскладывает ленты подписок и отмечает авторов, '
+        'чьи рецепты выбираются при чтении ленты'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild_feeds(FeedEntry, User, Subscribe)
+        self.stdout.write(
+            f'Записей в лентах: {total}, авторов с лентой при чтении: '
+            f'{User.objects.filter(fanout_on_read=True).count()}'
+        )
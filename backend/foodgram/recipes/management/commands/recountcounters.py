@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import recount_all
+from recipes.models import Favorite, Recipe, Tag, TagRecipe
+from recipes.tag_masks import recount_tag_masks
+from users.models import Subscribe, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, рецептов и подписчиков '
+        'и маски тегов рецептов'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = recount_all(Recipe, User, Favorite, Subscribe)
+            repaired['Recipe.tags_mask'] = recount_tag_masks(
+                Recipe, Tag, TagRecipe
+            )
+        for counter, count in repaired.items():
+            self.stdout.write(f'{counter}: исправлено {count}')
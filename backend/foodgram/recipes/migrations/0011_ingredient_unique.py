@@ -0,0 +1,55 @@
+# Generated by Django 3.2 on 2026-10-18 18:35
+
+from django.db import migrations
+from django.db.models import Count, F, Min, Value
+from django.db.models.functions import Least
+
+# наибольшее значение PositiveSmallIntegerField на всех СУБД
+MAX_AMOUNT = 32767
+
+
+def merge_duplicates(apps, schema_editor):
+    """Сливает повторяющиеся ингредиенты в строку с наименьшим id,
+    складывая их количества в рецептах (не больше MAX_AMOUNT).
+    Ограничение уникальности добавляет 0015: на PostgreSQL ALTER TABLE
+    в одной транзакции с изменёнными строками связей падает
+    с ошибкой pending trigger events"""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientToRecipe = apps.get_model('recipes', 'IngredientToRecipe')
+    groups = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in groups:
+        keep = group['keep']
+        duplicates = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(pk=keep)
+        for duplicate in duplicates.values_list('pk', flat=True):
+            links = IngredientToRecipe.objects.filter(ingredient=duplicate)
+            # в рецепте уже есть оставляемый ингредиент: количество
+            # повтора прибавляется к нему, а не теряется
+            conflicts = links.filter(
+                recipe__in=IngredientToRecipe.objects.filter(
+                    ingredient=keep
+                ).values('recipe')
+            )
+            for recipe, amount in conflicts.values_list('recipe', 'amount'):
+                IngredientToRecipe.objects.filter(
+                    recipe=recipe, ingredient=keep
+                ).update(amount=Least(
+                    F('amount') + amount, Value(MAX_AMOUNT)
+                ))
+            conflicts.delete()
+            links.update(ingredient=keep)
+        duplicates.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_imageupload'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
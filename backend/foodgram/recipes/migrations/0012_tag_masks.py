@@ -0,0 +1,43 @@
+# Generated by Django 3.2 on 2026-10-18 19:23
+
+from django.db import migrations, models
+from django.db.models import F
+
+# биты 0..62: маска остаётся положительным BIGINT
+MAX_TAG_BITS = 63
+
+
+def fill_tag_masks(apps, schema_editor):
+    """Раздаёт биты тегам по порядку id и заполняет маски рецептов
+    (то же, что recipes.tag_masks.recount_tag_masks для новых полей)"""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Tag = apps.get_model('recipes', 'Tag')
+    TagRecipe = apps.get_model('recipes', 'TagRecipe')
+    tags = Tag.objects.order_by('pk')[:MAX_TAG_BITS]
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+        tag.save(update_fields=['bit'])
+        Recipe.objects.filter(
+            pk__in=TagRecipe.objects.filter(tag=tag).values('recipe')
+        ).update(tags_mask=F('tags_mask').bitor(1 << bit))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, unique=True, verbose_name='Бит в маске тегов рецепта'),
+        ),
+        migrations.RunPython(fill_tag_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 3.2 on 2026-10-18 20:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def fill_feeds(apps, schema_editor):
+    """Отмечает популярных авторов и раскладывает в ленты подписчиков
+    остальных авторов по FEED_BACKFILL их последних рецептов. Копия
+    recipes.feed.rebuild_feeds на момент миграции: таблица лент пуста,
+    поэтому хватает обычного INSERT ... SELECT"""
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    User = apps.get_model('users', 'User')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    User.objects.filter(
+        subscribers_count__gte=settings.FEED_FANOUT_LIMIT
+    ).update(fanout_on_read=True)
+    ranked = Subscribe.objects.filter(
+        author__fanout_on_read=False, author__recipes__isnull=False
+    ).order_by().annotate(
+        feed_recipe=F('author__recipes__id'),
+        feed_date=F('author__recipes__pub_date'),
+        feed_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('pk'),
+            order_by=(F('feed_date').desc(), F('feed_recipe').desc()),
+        ),
+    ).values(
+        'user_id', 'author_id', 'feed_recipe', 'feed_date', 'feed_rank'
+    )
+    quote_name = schema_editor.connection.ops.quote_name
+    columns = ', '.join(
+        quote_name(FeedEntry._meta.get_field(name).column)
+        for name in ('user', 'recipe', 'author', 'pub_date')
+    )
+    sql, params = ranked.query.sql_with_params()
+    schema_editor.execute(
+        f'INSERT INTO {quote_name(FeedEntry._meta.db_table)} ({columns}) '
+        'SELECT user_id, feed_recipe, author_id, feed_date '
+        f'FROM ({sql}) feed WHERE feed_rank <= %s',
+        params + (settings.FEED_BACKFILL,),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_recipe_search'),
+        ('users', '0006_user_fanout_on_read'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор рецепта')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи лент',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feed_user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', 'author'], name='feed_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_entry'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
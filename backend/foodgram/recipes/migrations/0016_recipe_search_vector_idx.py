@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 20:44
+
+from django.db import migrations
+import recipes.indexes
+
+
+class AddIndexUnlessPostgres(migrations.AddIndex):
+    """На PostgreSQL индекс уже создан в 0013 SQL-запросом с тем же
+    именем: операция добавляет его только в состояние миграций"""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_ingredient_unique_constraint'),
+    ]
+
+    operations = [
+        AddIndexUnlessPostgres(
+            model_name='recipe',
+            index=recipes.indexes.SearchVectorIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+        ),
+    ]
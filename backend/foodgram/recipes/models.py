@@ -1,8 +1,14 @@
+import uuid
+
 from colorfield.fields import ColorField
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 
+from recipes.counters import DerivedFieldsMixin
+from recipes.indexes import SearchVectorIndex
+from recipes.storage import content_storage
 from users.models import User
 
 
@@ -19,6 +25,13 @@ class Tag(models.Model):
         unique=True,
         verbose_name='Слаг',
     )
+    bit = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        verbose_name='Бит в маске тегов рецепта',
+    )
 
     class Meta:
         verbose_name = 'Тег'
@@ -42,13 +55,21 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit',
+            )
+        ]
 
     def __str__(self):
         return f'{self.name}({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class Recipe(DerivedFieldsMixin, models.Model):
     """Модель рецепта"""
+    DERIVED_FIELDS = ('favorites_count', 'tags_mask', 'search_vector')
+
     author = models.ForeignKey(
         User,
         related_name='recipes',
@@ -67,8 +88,15 @@ class Recipe(models.Model):
         blank=True,
         null=True,
         upload_to='recipes/images/',
+        storage=content_storage,
         verbose_name='Фото рецепта',
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии фото',
+    )
     text = models.TextField(verbose_name='Описание рецепта')
     tags = models.ManyToManyField(
         Tag,
@@ -78,11 +106,39 @@ class Recipe(models.Model):
         validators=[MinValueValidator(1), ],
         verbose_name='Время приготовления',
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тегов',
+    )
+    # заполняется только на PostgreSQL, на SQLite поиск идёт
+    # по таблице FTS5 recipes_recipe_search
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            SearchVectorIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -187,3 +243,118 @@ class ShoppingCart(UserRecipeLink):
         verbose_name = 'В списке покупок'
         verbose_name_plural = 'В списке покупок'
         default_related_name = 'shoppingcart'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписок пользователя: записи раскладываются
+    подписчикам при публикации рецепта"""
+    # поиск по user покрывают составные индексы
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry',
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} в ленте {self.user_id}'
+
+
+class ShoppingListJob(models.Model):
+    """Задача фоновой генерации PDF со списком покупок"""
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В работе'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_jobs',
+        verbose_name='Пользователь',
+    )
+    digest = models.CharField(max_length=64, verbose_name='Хэш списка')
+    content = models.JSONField(verbose_name='Список покупок')
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING,
+        verbose_name='Статус',
+    )
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name='Создана',
+    )
+
+    class Meta:
+        verbose_name = 'Генерация списка покупок'
+        verbose_name_plural = 'Генерация списков покупок'
+
+    def __str__(self):
+        return f'{self.user} {self.digest[:8]} {self.status}'
+
+
+class ImageUpload(models.Model):
+    """Фото, загруженное отдельно от рецепта;
+    рецепт получает его по токену"""
+    token = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False,
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='image_uploads',
+        verbose_name='Пользователь',
+    )
+    image = models.ImageField(
+        upload_to='recipes/images/',
+        storage=content_storage,
+        verbose_name='Фото',
+    )
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name='Загружено',
+    )
+
+    class Meta:
+        verbose_name = 'Загрузка фото'
+        verbose_name_plural = 'Загрузки фото'
+
+    def __str__(self):
+        return f'{self.user} {self.token}'
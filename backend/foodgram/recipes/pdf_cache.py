@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+
+def shopping_list_digest(shopping_list):
+    """Адрес PDF в кэше: хэш содержимого списка покупок"""
+    content = json.dumps(shopping_list, ensure_ascii=False)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class PdfCache:
+    """Кэш PDF на диске с вытеснением давно не использованных файлов.
+
+    Время последнего использования хранится в mtime файла, поэтому
+    кэш можно делить между воркерами gunicorn"""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.pdf')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return file
+
+    def set(self, key, content):
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(
+            dir=self.directory, suffix='.tmp'
+        )
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.pdf'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_or_render(self, key, render):
+        """Файл PDF из кэша; при промахе render() -> BytesIO с PDF"""
+        file = self.get(key)
+        if file is not None:
+            return file
+        buffer = render()
+        self.set(key, buffer.getvalue())
+        return buffer
+
+
+pdf_cache = PdfCache(
+    settings.SHOPPING_LIST_CACHE_DIR, settings.SHOPPING_LIST_CACHE_SIZE
+)
@@ -2,7 +2,9 @@ import io
 
 import reportlab
 from django.conf import settings
+from django.db.models import Sum
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
@@ -13,48 +15,64 @@ reportlab.rl_config.TTFSearchPath.append(
 )
 pdfmetrics.registerFont(TTFont('FreeSans', 'FreeSans.ttf'))
 
+FONT = 'FreeSans'
+FONT_SIZE = 10
+LINE_HEIGHT = 15
+LEFT_MARGIN = 100
+RIGHT_MARGIN = 50
+TOP = 800
+BOTTOM_MARGIN = 50
+
 
 def parse_data(ingredients_to_recipes):
-    ingredients = {}
-    for link in ingredients_to_recipes:
-        ingredient = link.ingredient
-        if ingredient in ingredients:
-            ingredients[ingredient] += link.amount
-        else:
-            ingredients[ingredient] = link.amount
-
-    parsed_data = []
-    for key, value in ingredients.items():
-        pdf_string = [
-            key.name,
-            key.measurement_unit,
-            value,
+    """Суммирует количество ингредиентов одним запросом к БД"""
+    totals = ingredients_to_recipes.filter(
+        ingredient__isnull=False
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        total=Sum('amount')
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    )
+    return [
+        [
+            row['ingredient__name'],
+            row['ingredient__measurement_unit'],
+            row['total'],
         ]
-        parsed_data.append(pdf_string)
-    return parsed_data
-
+        for row in totals
+    ]
 
-def generate(ingredients_to_recipes):
-    buffer = io.BytesIO()
-    file = canvas.Canvas(buffer, pagesize=A4)
 
-    file.setFont('FreeSans', 15, leading=None)
-    file.drawString(200, 800, 'Foodgram by Anton Gridasov')
+def draw_header(file):
+    file.setFont(FONT, 15, leading=None)
+    file.drawString(200, TOP, 'Foodgram by Anton Gridasov')
     file.line(0, 780, 1000, 780)
     file.drawString(200, 750, 'Список покупок:')
+    return 720
 
-    parsed_data = parse_data(ingredients_to_recipes)
-    x = 100
-    y = 660
 
-    for string in parsed_data:
-        file.setFont('FreeSans', 10, leading=None)
-        file.drawString(
-            x,
-            y,
-            f'- {string[0]} ({string[1]}) - {str(string[2])}'
+def render(shopping_list):
+    """Рисует PDF по результату parse_data"""
+    buffer = io.BytesIO()
+    file = canvas.Canvas(buffer, pagesize=A4)
+    width = A4[0] - LEFT_MARGIN - RIGHT_MARGIN
+
+    y = draw_header(file)
+    file.setFont(FONT, FONT_SIZE, leading=None)
+    for string in shopping_list:
+        lines = simpleSplit(
+            f'- {string[0]} ({string[1]}) - {str(string[2])}',
+            FONT, FONT_SIZE, width
         )
-        y += 15
+        for line in lines:
+            if y < BOTTOM_MARGIN:
+                file.showPage()
+                file.setFont(FONT, FONT_SIZE, leading=None)
+                y = TOP
+            file.drawString(LEFT_MARGIN, y, line)
+            y -= LINE_HEIGHT
 
     file.showPage()
     file.save()
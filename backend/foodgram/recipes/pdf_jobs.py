@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from recipes import pdf_generator
+from recipes.models import ShoppingListJob
+from recipes.pdf_cache import pdf_cache
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.SHOPPING_LIST_RENDER_WORKERS,
+    thread_name_prefix='shopping-list',
+)
+
+
+def render_job(job_id):
+    """Генерирует PDF задачи и кладёт его в кэш по хэшу"""
+    close_old_connections()
+    try:
+        job = ShoppingListJob.objects.get(pk=job_id)
+        try:
+            buffer = pdf_generator.render(job.content)
+            pdf_cache.set(job.digest, buffer.getvalue())
+            job.status = ShoppingListJob.DONE
+        except Exception:
+            job.status = ShoppingListJob.FAILED
+            raise
+        finally:
+            job.save(update_fields=['status'])
+    finally:
+        close_old_connections()
+
+
+def fail_stale(jobs):
+    """Задачи из jobs, которые в работе дольше
+    SHOPPING_LIST_JOB_TIMEOUT, считаются упавшими: их воркер
+    мог перезапуститься, и никто их уже не выполнит"""
+    jobs.filter(
+        status=ShoppingListJob.PENDING,
+        created__lt=timezone.now() - timedelta(
+            seconds=settings.SHOPPING_LIST_JOB_TIMEOUT
+        ),
+    ).update(status=ShoppingListJob.FAILED)
+
+
+def enqueue(user, digest, shopping_list):
+    """Ставит генерацию в очередь; повторный запрос того же
+    списка возвращает уже созданную задачу, если она не упала"""
+    ShoppingListJob.objects.filter(
+        created__lt=timezone.now() - timedelta(
+            seconds=settings.SHOPPING_LIST_JOB_TTL
+        )
+    ).delete()
+    jobs = ShoppingListJob.objects.filter(user=user, digest=digest)
+    fail_stale(jobs)
+    job = jobs.exclude(status=ShoppingListJob.FAILED).first()
+    if job is None:
+        job = ShoppingListJob.objects.create(
+            user=user, digest=digest, content=shopping_list
+        )
+        executor.submit(render_job, job.pk)
+    return job
@@ -0,0 +1,109 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, Q
+
+FTS_TABLE = 'recipes_recipe_search'
+SEARCH_CONFIG = 'russian'
+# название весит больше описания
+NAME_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+
+WORD = re.compile(r'\w+')
+# окончания, которые отбрасываются у слов запроса для SQLite:
+# в FTS5 нет русского стеммера, поэтому слово ищется по основе
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'его', 'ого', 'ему', 'ому', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую',
+    'юю', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ии', 'ия',
+    'ью', 'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def fts_query(text):
+    """Запрос FTS5: все слова по основе, как префиксы"""
+    words = WORD.findall(text.lower())
+    return ' '.join(f'"{stem(word)}"*' for word in words)
+
+
+def search_recipes(queryset, text):
+    """Рецепты, подходящие под запрос, с релевантностью search_rank
+    (чем больше, тем лучше), отсортированные по ней"""
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+    if connection.vendor == 'sqlite':
+        query = fts_query(text)
+        if not query:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        # виртуальную таблицу FTS5 ORM не видит: join через extra
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE} MATCH %s',
+                f'{FTS_TABLE}.rowid = {table}.id',
+            ],
+            params=[query],
+            select={
+                'search_rank':
+                    f'-bm25({FTS_TABLE}, {NAME_WEIGHT}, {TEXT_WEIGHT})',
+            },
+        ).order_by('-search_rank', '-pub_date', '-id')
+    return queryset.filter(
+        Q(name__icontains=text) | Q(text__icontains=text)
+    ).order_by('-pub_date', '-id')
+
+
+def index_recipe(Recipe, pk):
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk=pk).update(search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, text) '
+                f'SELECT id, name, text FROM {Recipe._meta.db_table} '
+                'WHERE id = %s',
+                [pk],
+            )
+
+
+def unindex_recipe(pk):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+
+def rebuild_search_index(Recipe):
+    """Заново индексирует все рецепты. Модель передаётся
+    параметром, чтобы функцию можно было вызвать из миграции"""
+    if connection.vendor == 'postgresql':
+        Recipe.objects.update(search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                f'SELECT id, name, text FROM {Recipe._meta.db_table}'
+            )
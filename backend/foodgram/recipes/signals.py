@@ -0,0 +1,208 @@
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import Signal, receiver
+
+from recipes import feed, images, search
+from recipes.counters import actual_count
+from recipes.models import Favorite, FeedEntry, Recipe, Tag, TagRecipe
+from recipes.tag_masks import (bits_mask, clear_bits, free_bit, set_bits,
+                               with_any_bit)
+from users.models import Subscribe, User
+
+# bulk_create не отправляет post_save: массовые вставки избранного,
+# списка покупок и подписок отправляют этот сигнал с user_id и ids
+# (id рецептов или авторов)
+links_bulk_created = Signal()
+# то же для массового удаления: оно не отправляет post_delete
+# на каждую строку
+links_bulk_deleted = Signal()
+# массовая загрузка каталога ингредиентов (count - число новых строк)
+ingredients_bulk_loaded = Signal()
+
+# поля рецепта, по которым идёт полнотекстовый поиск
+SEARCH_FIELDS = {'name', 'text'}
+# id удаляемых тегов: маски их рецептов исправлены одним UPDATE,
+# и каскадное удаление связей не пересчитывает их по одной
+deleting_tags = ContextVar('deleting_tags', default=frozenset())
+
+
+def change_counter(queryset, field, delta):
+    """Атомарно меняет счётчик field на delta, не уходя ниже нуля"""
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_created(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id), 'favorites_count', 1
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), 'favorites_count', -1
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_changing(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    old_author, old_image = Recipe.objects.filter(
+        pk=instance.pk
+    ).values_list('author_id', 'image').first() or (None, None)
+    if old_image != instance.image.name:
+        instance.image_variants = {}
+    if old_author != instance.author_id:
+        FeedEntry.objects.filter(recipe=instance.pk).delete()
+        feed.fan_out(FeedEntry, Subscribe, instance)
+        change_counter(
+            User.objects.filter(pk=old_author), 'recipes_count', -1
+        )
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', 1
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', 1
+        )
+        feed.fan_out(FeedEntry, Subscribe, instance)
+    if instance.image and not instance.image_variants:
+        transaction.on_commit(lambda: images.enqueue(instance.pk))
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        search.index_recipe(Recipe, instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count', -1
+    )
+    search.unindex_recipe(instance.pk)
+
+
+@receiver(pre_save, sender=Tag)
+def tag_creating(sender, instance, **kwargs):
+    if instance._state.adding and instance.bit is None:
+        instance.bit = free_bit(Tag)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    mask = bits_mask([instance.bit])
+    clear_bits(with_any_bit(Recipe.objects.all(), mask), mask)
+    deleting_tags.set(deleting_tags.get() | {instance.pk})
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    deleting_tags.set(deleting_tags.get() - {instance.pk})
+
+
+@receiver(m2m_changed, sender=TagRecipe)
+def tags_linked(sender, instance, action, reverse, pk_set, **kwargs):
+    """recipe.tags.add/remove/clear и то же со стороны тега"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        mask = bits_mask([instance.bit])
+        recipes = (
+            with_any_bit(Recipe.objects.all(), mask) if pk_set is None
+            else Recipe.objects.filter(pk__in=pk_set)
+        )
+    elif action == 'post_clear':
+        Recipe.objects.filter(pk=instance.pk).update(tags_mask=0)
+        return
+    else:
+        mask = bits_mask(
+            Tag.objects.filter(pk__in=pk_set).values_list('bit', flat=True)
+        )
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    if action == 'post_add':
+        set_bits(recipes, mask)
+    else:
+        clear_bits(recipes, mask)
+
+
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+def tag_link_changed(sender, instance, **kwargs):
+    """Отдельные связи меняет админка и каскадное удаление"""
+    if instance.tag_id in deleting_tags.get():
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        tags_mask=bits_mask(
+            Tag.objects.filter(
+                tagrecipe__recipe=instance.recipe_id
+            ).values_list('bit', flat=True)
+        )
+    )
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribe_created(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id),
+            'subscribers_count',
+            1
+        )
+        feed.mark_popular(User, [instance.author_id])
+        feed.fill_feeds(FeedEntry, Subscribe.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_deleted(sender, instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'subscribers_count', -1
+    )
+    feed.prune_feed(FeedEntry, instance.user_id, instance.author_id)
+
+
+def recount_links(sender, ids):
+    """Пересчитывает одним UPDATE счётчики объектов ids после массовой
+    вставки или удаления связей: bulk_create(ignore_conflicts=True)
+    не сообщает, какие строки вставлены, а параллельный запрос мог
+    успеть удалить те же связи раньше"""
+    if sender is Favorite:
+        Recipe.objects.filter(pk__in=ids).update(
+            favorites_count=actual_count(Favorite, 'recipe')
+        )
+    elif sender is Subscribe:
+        User.objects.filter(pk__in=ids).update(
+            subscribers_count=actual_count(Subscribe, 'author')
+        )
+
+
+@receiver(links_bulk_created)
+def links_bulk_created_counters(sender, user_id, ids, **kwargs):
+    if not ids:
+        return
+    recount_links(sender, ids)
+    if sender is Subscribe:
+        feed.mark_popular(User, ids)
+        feed.fill_feeds(
+            FeedEntry,
+            Subscribe.objects.filter(user=user_id, author__in=ids),
+        )
+
+
+@receiver(links_bulk_deleted)
+def links_bulk_deleted_counters(sender, user_id, ids, **kwargs):
+    if not ids:
+        return
+    recount_links(sender, ids)
+    if sender is Subscribe:
+        feed.prune_feeds(FeedEntry, user_id, ids)
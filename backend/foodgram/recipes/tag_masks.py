@@ -0,0 +1,79 @@
+from django.db.models import F
+
+# биты 0..62: маска остаётся положительным BIGINT
+MAX_TAG_BITS = 63
+
+
+def bits_mask(bits):
+    mask = 0
+    for bit in bits:
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+
+def free_bit(Tag):
+    """Наименьший свободный бит или None, если все заняты"""
+    used = set(
+        Tag.objects.exclude(bit=None).values_list('bit', flat=True)
+    )
+    return next(
+        (bit for bit in range(MAX_TAG_BITS) if bit not in used), None
+    )
+
+
+def with_any_bit(queryset, mask):
+    """Рецепты, у которых в маске есть хотя бы один бит из mask"""
+    return queryset.alias(
+        matching_tags=F('tags_mask').bitand(mask)
+    ).filter(matching_tags__gt=0)
+
+
+def set_bits(queryset, mask):
+    if mask:
+        queryset.update(tags_mask=F('tags_mask').bitor(mask))
+
+
+def clear_bits(queryset, mask):
+    if mask:
+        queryset.update(tags_mask=F('tags_mask').bitand(~mask))
+
+
+def recount_tag_masks(Recipe, Tag, TagRecipe):
+    """Раздаёт свободные биты тегам без бита и исправляет маски,
+    разошедшиеся с TagRecipe; возвращает число исправлений.
+    Модели передаются параметрами, чтобы функцию можно было
+    вызвать и из миграции"""
+    for tag in Tag.objects.filter(bit=None).order_by('pk'):
+        tag.bit = free_bit(Tag)
+        if tag.bit is None:
+            break
+        tag.save(update_fields=['bit'])
+
+    repaired = 0
+    bits = dict(
+        Tag.objects.exclude(bit=None).values_list('pk', 'bit')
+    )
+    for tag_id, bit in bits.items():
+        mask = 1 << bit
+        tagged = TagRecipe.objects.filter(tag_id=tag_id).values('recipe')
+        missing = Recipe.objects.filter(pk__in=tagged).alias(
+            matching_tags=F('tags_mask').bitand(mask)
+        ).filter(matching_tags=0)
+        extra = with_any_bit(Recipe.objects.exclude(pk__in=tagged), mask)
+        for stale, fix in ((missing, set_bits), (extra, clear_bits)):
+            count = stale.count()
+            if count:
+                # подзапросом, а не списком id: рецептов может быть
+                # больше, чем SQLite допускает параметров в запросе
+                fix(Recipe.objects.filter(pk__in=stale.values('pk')), mask)
+                repaired += count
+
+    # биты удалённых тегов
+    unused = bits_mask(range(MAX_TAG_BITS)) & ~bits_mask(bits.values())
+    stale = with_any_bit(Recipe.objects.all(), unused)
+    count = stale.count()
+    if count:
+        clear_bits(Recipe.objects.filter(pk__in=stale.values('pk')), unused)
+        repaired += count
+    return repaired
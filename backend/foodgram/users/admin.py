@@ -10,8 +10,8 @@ class UserAdmin(admin.ModelAdmin):
         'username',
         'first_name',
         'last_name',
-        'get_recipes_count',
-        'get_subscribers_count',
+        'recipes_count',
+        'subscribers_count',
     )
     search_fields = (
         'email',
@@ -27,16 +27,6 @@ class UserAdmin(admin.ModelAdmin):
     )
     empty_value_display = '-пусто-'
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
-    get_recipes_count.short_description = 'Количество рецептов'
-
-    def get_subscribers_count(self, obj):
-        return obj.subscribed.count()
-
-    get_subscribers_count.short_description = 'Количество подписчиков'
-
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Subscribe)
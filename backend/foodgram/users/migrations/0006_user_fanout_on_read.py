@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='fanout_on_read',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Лента подписчиков собирается при чтении'),
+        ),
+    ]
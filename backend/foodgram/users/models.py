@@ -2,9 +2,13 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from recipes.counters import DerivedFieldsMixin
 
-class User(AbstractUser):
+
+class User(DerivedFieldsMixin, AbstractUser):
     """Модель пользователя"""
+    DERIVED_FIELDS = ('recipes_count', 'subscribers_count', 'fanout_on_read')
+
     username = models.CharField(
         max_length=settings.USER_MODELS_FIELD_LENGTH,
         unique=True,
@@ -20,6 +24,23 @@ class User(AbstractUser):
     last_name = models.CharField(
         max_length=settings.USER_MODELS_FIELD_LENGTH,
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+    # рецепты автора с множеством подписчиков не раскладываются
+    # по лентам, а выбираются при чтении ленты
+    fanout_on_read = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Лента подписчиков собирается при чтении',
+    )
 
     REQUIRED_FIELDS = [
         'username', 'first_name', 'last_name',